@@ -1,37 +1,272 @@
 # config_sidekick.py
+import logging
 import os
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """Dilempar saat satu atau lebih nilai konfigurasi tidak valid."""
+
+
+# --- Parser nilai ---
+def _optional_int(value):
+    return int(value) if str(value).strip() else None
+
+
+def _int_list(value):
+    return tuple(int(item) for item in str(value).split(",") if item.strip())
+
+
+def _flag(value):
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+def _rate_map(value):
+    # "event=0.1,event2=0.5" -> (("event", 0.1), ("event2", 0.5))
+    rates = []
+    for item in str(value).split(","):
+        if item.strip():
+            key, rate = item.split("=", 1)
+            rates.append((key.strip(), float(rate)))
+    return tuple(rates)
+
+
+def _limits(value):
+    # "identity:user=1/120,banter:chat=6/300" -> (("identity", "user", 1, 120.0), ("banter", "chat", 6, 300.0))
+    limits = []
+    for item in str(value).split(","):
+        if item.strip():
+            target, rule = item.split("=", 1)
+            kind, scope = target.strip().split(":", 1)
+            if scope not in ("user", "chat"):
+                raise ValueError(f"cakupan '{scope}' harus user atau chat")
+            count, seconds = rule.split("/", 1)
+            limits.append((kind, scope, int(count), float(seconds)))
+    return tuple(limits)
+
+
+def _choice(*allowed):
+    def parse(value):
+        if value not in allowed:
+            raise ValueError(f"harus salah satu dari {', '.join(allowed)}")
+        return value
+    return parse
+
+
+# (nama, variabel lingkungan, parser, nilai bawaan)
+_SPEC = (
+    # Kredensial dan alamat webhook
+    ("SIDEKICK_BOT_TOKEN", "SIDEKICK_BOT_TOKEN", str, None),
+    ("WEBHOOK_BASE_URL", "WEBHOOK_BASE_URL", str, None),
+    # ID numerik bot utama, grup, dan pemilik grup (penerima laporan)
+    ("MAIN_BOT_USER_ID", "MAIN_BOT_USER_ID", _optional_int, None),
+    ("GROUP_CHAT_ID", "GROUP_CHAT_ID", _optional_int, None),
+    ("GROUP_OWNER_ID", "GROUP_OWNER_ID", _optional_int, None),
+    # Menggunakan URL database terpisah untuk menghindari konflik
+    ("DATABASE_URL", "SIDEKICK_DATABASE_URL", str, None),
+    # Kunci API untuk layanan Groq AI
+    ("GROQ_API_KEY", "GROQ_API_KEY", str, None),
+    # Pengaturan pool koneksi database (jumlah minimum/maksimum koneksi
+    # dan berapa detik koneksi idle boleh bertahan sebelum ditutup)
+    ("DB_POOL_MIN_SIZE", "SIDEKICK_DB_POOL_MIN_SIZE", int, 1),
+    ("DB_POOL_MAX_SIZE", "SIDEKICK_DB_POOL_MAX_SIZE", int, 5),
+    ("DB_POOL_MAX_IDLE_SECONDS", "SIDEKICK_DB_POOL_MAX_IDLE_SECONDS", float, 300.0),
+    # Berapa detik cache jadwal di memori dianggap valid sebelum dibaca ulang dari DB
+    ("SCHEDULE_CACHE_TTL_SECONDS", "SIDEKICK_SCHEDULE_CACHE_TTL_SECONDS", float, 600.0),
+    # Jeda acak maksimum (detik) yang ditambahkan ke setiap jadwal posting
+    ("SCHEDULER_JITTER_SECONDS", "SIDEKICK_SCHEDULER_JITTER_SECONDS", float, 20.0),
+    # Masa sewa (detik) sebuah slot jadwal yang sudah diklaim; bila replika pengklaim
+    # tidak melapor selesai dalam waktu ini, replika lain boleh mengambil alih slot itu
+    ("SCHEDULE_LEASE_SECONDS", "SIDEKICK_SCHEDULE_LEASE_SECONDS", float, 600.0),
+    # Eksekutor tugas tertunda: jumlah worker, batas antrean, dan kebijakan saat antrean penuh
+    ("TASK_WORKERS", "SIDEKICK_TASK_WORKERS", int, 4),
+    ("TASK_MAX_PENDING", "SIDEKICK_TASK_MAX_PENDING", int, 1000),
+    ("TASK_OVERFLOW_POLICY", "SIDEKICK_TASK_OVERFLOW_POLICY", _choice("drop_oldest", "reject"), "drop_oldest"),
+    # Jumlah worker khusus untuk posting terjadwal dan pembaruan AI (terpisah dari worker balasan)
+    ("SCHEDULE_WORKERS", "SIDEKICK_SCHEDULE_WORKERS", int, 2),
+    # Antrean webhook: jumlah worker pemroses update, kapasitas antrean, dan kebijakan saat antrean penuh
+    ("WEBHOOK_WORKERS", "SIDEKICK_WEBHOOK_WORKERS", int, 2),
+    ("WEBHOOK_QUEUE_SIZE", "SIDEKICK_WEBHOOK_QUEUE_SIZE", int, 500),
+    ("WEBHOOK_ADMISSION_POLICY", "SIDEKICK_WEBHOOK_ADMISSION_POLICY",
+     _choice("reject", "drop_newest", "drop_oldest"), "reject"),
+    # Deduplikasi update Telegram berdasarkan update_id: ukuran jendela di memori,
+    # masa berlaku (detik), dan opsi menyimpannya juga di Postgres
+    ("DEDUP_WINDOW_SIZE", "SIDEKICK_DEDUP_WINDOW_SIZE", int, 5000),
+    ("DEDUP_TTL_SECONDS", "SIDEKICK_DEDUP_TTL_SECONDS", float, 3600.0),
+    ("DEDUP_PERSISTENT", "SIDEKICK_DEDUP_PERSISTENT", _flag, False),
+    # Batas kirim pesan keluar: pesan per detik secara global, pesan per menit
+    # per chat, dan jumlah pesan beruntun yang boleh dikirim ke satu chat
+    ("OUTBOUND_GLOBAL_RATE", "SIDEKICK_OUTBOUND_GLOBAL_RATE", float, 25.0),
+    ("OUTBOUND_CHAT_RATE_PER_MINUTE", "SIDEKICK_OUTBOUND_CHAT_RATE_PER_MINUTE", float, 20.0),
+    ("OUTBOUND_CHAT_BURST", "SIDEKICK_OUTBOUND_CHAT_BURST", int, 3),
+    # Jumlah thread pengirim; naikkan bila satu jadwal disiarkan ke ratusan grup
+    ("OUTBOUND_WORKERS", "SIDEKICK_OUTBOUND_WORKERS", int, 3),
+    # File JSON berisi daftar grup (chat_id, zona waktu, jadwal, bobot kategori);
+    # kosong berarti hanya GROUP_CHAT_ID dengan jadwal bawaan
+    ("GROUPS_FILE", "SIDEKICK_GROUPS_FILE", str, None),
+    # Sambutan anggota baru dikumpulkan per chat selama jendela ini (detik),
+    # lalu dikirim sebagai satu pesan yang menyebut paling banyak N anggota
+    ("GREETING_WINDOW_SECONDS", "SIDEKICK_GREETING_WINDOW_SECONDS", float, 30.0),
+    ("GREETING_MAX_MENTIONS", "SIDEKICK_GREETING_MAX_MENTIONS", int, 10),
+    # Seberapa sering (detik) versi korpus respons di Postgres diperiksa ulang
+    ("CORPUS_REFRESH_SECONDS", "SIDEKICK_CORPUS_REFRESH_SECONDS", float, 300.0),
+    # Pembaruan AI mingguan: jumlah kategori yang diminta bersamaan, jumlah
+    # percobaan ulang per kategori, dan batas waktu total (detik)
+    ("AI_RENEWAL_CONCURRENCY", "SIDEKICK_AI_RENEWAL_CONCURRENCY", int, 3),
+    ("AI_RENEWAL_MAX_RETRIES", "SIDEKICK_AI_RENEWAL_MAX_RETRIES", int, 3),
+    ("AI_RENEWAL_DEADLINE_SECONDS", "SIDEKICK_AI_RENEWAL_DEADLINE_SECONDS", float, 240.0),
+    # Jumlah maksimum entri per kategori setelah hasil AI digabung ke korpus
+    ("AI_CORPUS_MAX_ENTRIES", "SIDEKICK_AI_CORPUS_MAX_ENTRIES", int, 150),
+    # Balasan AI langsung untuk mention dan reply ke Sidekick: aktif/tidak, jumlah panggilan
+    # Groq per menit, ukuran dan masa berlaku cache jawaban, batas waktu panggilan, jumlah thread
+    ("LIVE_REPLY_ENABLED", "SIDEKICK_LIVE_REPLY_ENABLED", _flag, True),
+    ("LIVE_REPLY_BUDGET_PER_MINUTE", "SIDEKICK_LIVE_REPLY_BUDGET_PER_MINUTE", int, 20),
+    ("LIVE_REPLY_CACHE_SIZE", "SIDEKICK_LIVE_REPLY_CACHE_SIZE", int, 500),
+    ("LIVE_REPLY_CACHE_TTL_SECONDS", "SIDEKICK_LIVE_REPLY_CACHE_TTL_SECONDS", float, 900.0),
+    ("LIVE_REPLY_TIMEOUT_SECONDS", "SIDEKICK_LIVE_REPLY_TIMEOUT_SECONDS", float, 8.0),
+    ("LIVE_REPLY_WORKERS", "SIDEKICK_LIVE_REPLY_WORKERS", int, 2),
+    # Outbox kiriman tertunda di Postgres: jumlah baris per klaim, interval polling maksimum (detik),
+    # masa sewa baris yang sedang dikirim, dan batas usia (detik) kiriman yang masih diputar ulang setelah restart
+    ("OUTBOX_BATCH_SIZE", "SIDEKICK_OUTBOX_BATCH_SIZE", int, 50),
+    ("OUTBOX_POLL_SECONDS", "SIDEKICK_OUTBOX_POLL_SECONDS", float, 5.0),
+    ("OUTBOX_LEASE_SECONDS", "SIDEKICK_OUTBOX_LEASE_SECONDS", float, 120.0),
+    ("OUTBOX_STALE_SECONDS", "SIDEKICK_OUTBOX_STALE_SECONDS", float, 600.0),
+    # Jeda (detik) sebelum membalas pesan bot utama dan pertanyaan identitas
+    ("BANTER_DELAY_SECONDS", "SIDEKICK_BANTER_DELAY_SECONDS", float, 30.0),
+    ("IDENTITY_DELAY_SECONDS", "SIDEKICK_IDENTITY_DELAY_SECONDS", float, 5.0),
+    # Logging: level, format JSON per baris, kapasitas antrean log, batas baris INFO per menit
+    # untuk setiap jenis event (0 = tanpa batas), dan laju sampling per event ("event=0.1,...")
+    ("LOG_LEVEL", "SIDEKICK_LOG_LEVEL", _choice("DEBUG", "INFO", "WARNING", "ERROR"), "INFO"),
+    ("LOG_JSON", "SIDEKICK_LOG_JSON", _flag, False),
+    ("LOG_QUEUE_SIZE", "SIDEKICK_LOG_QUEUE_SIZE", int, 10000),
+    ("LOG_RATE_LIMIT_PER_MINUTE", "SIDEKICK_LOG_RATE_LIMIT_PER_MINUTE", int, 120),
+    ("LOG_SAMPLE_RATES", "SIDEKICK_LOG_SAMPLE_RATES", _rate_map, ()),
+    # Probe latar untuk endpoint readiness: interval dan batas waktu (detik) per dependensi
+    ("PROBE_DB_INTERVAL_SECONDS", "SIDEKICK_PROBE_DB_INTERVAL_SECONDS", float, 30.0),
+    ("PROBE_DB_TIMEOUT_SECONDS", "SIDEKICK_PROBE_DB_TIMEOUT_SECONDS", float, 3.0),
+    ("PROBE_TELEGRAM_INTERVAL_SECONDS", "SIDEKICK_PROBE_TELEGRAM_INTERVAL_SECONDS", float, 60.0),
+    ("PROBE_TELEGRAM_TIMEOUT_SECONDS", "SIDEKICK_PROBE_TELEGRAM_TIMEOUT_SECONDS", float, 5.0),
+    ("PROBE_GROQ_INTERVAL_SECONDS", "SIDEKICK_PROBE_GROQ_INTERVAL_SECONDS", float, 300.0),
+    ("PROBE_GROQ_TIMEOUT_SECONDS", "SIDEKICK_PROBE_GROQ_TIMEOUT_SECONDS", float, 10.0),
+    # Batas balasan per jenis pemicu, per pengguna atau per chat: "jenis:cakupan=jumlah/detik,...";
+    # jenis yang dikenal: identity, banter, live_reply
+    ("COOLDOWN_LIMITS", "SIDEKICK_COOLDOWN_LIMITS", _limits,
+     _limits("identity:user=1/120,identity:chat=4/60,banter:chat=6/300,live_reply:user=4/60,live_reply:chat=12/60")),
+    # Jumlah maksimum kunci (pengguna/chat) yang dilacak untuk cooldown
+    ("COOLDOWN_MAX_KEYS", "SIDEKICK_COOLDOWN_MAX_KEYS", int, 10000),
+    # Token untuk endpoint admin /admin/sidekick/* (profiling, tracemalloc, dump thread);
+    # kosong berarti endpoint admin dimatikan
+    ("ADMIN_TOKEN", "SIDEKICK_ADMIN_TOKEN", str, None),
+    # Daftar ID chat (dipisah koma) yang update-nya diproses; kosong berarti semua chat
+    ("ALLOWED_CHAT_IDS", "SIDEKICK_ALLOWED_CHAT_IDS", _int_list, ()),
+)
+
+# Nilai-nilai ini dipakai saat komponen dibuat, jadi perubahannya baru berlaku setelah restart.
+RESTART_ONLY = frozenset((
+    "SIDEKICK_BOT_TOKEN", "WEBHOOK_BASE_URL", "DATABASE_URL", "GROQ_API_KEY", "GROUP_CHAT_ID", "GROUPS_FILE",
+    "DB_POOL_MIN_SIZE", "DB_POOL_MAX_SIZE", "DB_POOL_MAX_IDLE_SECONDS",
+    "SCHEDULE_CACHE_TTL_SECONDS", "SCHEDULER_JITTER_SECONDS", "SCHEDULE_LEASE_SECONDS",
+    "TASK_WORKERS", "TASK_MAX_PENDING", "TASK_OVERFLOW_POLICY", "SCHEDULE_WORKERS",
+    "WEBHOOK_WORKERS", "WEBHOOK_QUEUE_SIZE", "WEBHOOK_ADMISSION_POLICY",
+    "DEDUP_WINDOW_SIZE", "DEDUP_TTL_SECONDS", "DEDUP_PERSISTENT",
+    "OUTBOUND_GLOBAL_RATE", "OUTBOUND_CHAT_RATE_PER_MINUTE", "OUTBOUND_CHAT_BURST", "OUTBOUND_WORKERS",
+    "CORPUS_REFRESH_SECONDS",
+    "OUTBOX_BATCH_SIZE", "OUTBOX_POLL_SECONDS", "OUTBOX_LEASE_SECONDS", "OUTBOX_STALE_SECONDS",
+    "LIVE_REPLY_ENABLED", "LIVE_REPLY_BUDGET_PER_MINUTE", "LIVE_REPLY_CACHE_SIZE", "LIVE_REPLY_CACHE_TTL_SECONDS",
+    "LIVE_REPLY_TIMEOUT_SECONDS", "LIVE_REPLY_WORKERS",
+    "LOG_LEVEL", "LOG_JSON", "LOG_QUEUE_SIZE", "LOG_RATE_LIMIT_PER_MINUTE", "LOG_SAMPLE_RATES",
+    "PROBE_DB_INTERVAL_SECONDS", "PROBE_DB_TIMEOUT_SECONDS", "PROBE_TELEGRAM_INTERVAL_SECONDS",
+    "PROBE_TELEGRAM_TIMEOUT_SECONDS", "PROBE_GROQ_INTERVAL_SECONDS", "PROBE_GROQ_TIMEOUT_SECONDS",
+    "COOLDOWN_MAX_KEYS",
+))
+
+Settings = namedtuple("Settings", [name for name, _, _, _ in _SPEC])
+
+
+def _read_sources():
+    """Variabel lingkungan, ditimpa oleh isi SIDEKICK_CONFIG_FILE (baris KEY=VALUE) jika ada."""
+    values = dict(os.environ)
+    path = values.get("SIDEKICK_CONFIG_FILE")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as config_file:
+                for line in config_file:
+                    line = line.strip()
+                    if line and not line.startswith("#") and "=" in line:
+                        key, value = line.split("=", 1)
+                        values[key.strip()] = value.strip().strip('"\'')
+        except OSError as e:
+            raise ConfigError(f"tidak bisa membaca {path}: {e}")
+    return values
+
+
+def build_settings(values):
+    """Mem-parse dan memvalidasi semua nilai sekaligus menjadi satu Settings yang tidak bisa diubah."""
+    parsed, errors = {}, []
+    for name, env_name, parse, default in _SPEC:
+        raw = values.get(env_name)
+        if raw is None or (raw == "" and default is not None):
+            parsed[name] = default
+            continue
+        try:
+            parsed[name] = parse(raw)
+        except ValueError as e:
+            errors.append(f"{env_name}={raw!r}: {e}")
+    if not errors and parsed["DB_POOL_MIN_SIZE"] > parsed["DB_POOL_MAX_SIZE"]:
+        errors.append("SIDEKICK_DB_POOL_MIN_SIZE tidak boleh lebih besar dari SIDEKICK_DB_POOL_MAX_SIZE")
+    if errors:
+        raise ConfigError("; ".join(errors))
+    return Settings(**parsed)
+
 
 class Config:
     """
     Kelas untuk mengelola semua variabel konfigurasi untuk Sidekick Bot.
+
+    Semua nilai di-parse sekali menjadi snapshot `Settings` yang tidak bisa
+    diubah; kode di jalur panas cukup memanggil `Config.current()` lalu
+    membaca atributnya. `reload()` membangun snapshot baru dan menukarnya
+    secara atomik, jadi pembaca selalu melihat snapshot lama atau baru secara
+    utuh.
     """
-    @staticmethod
-    def SIDEKICK_BOT_TOKEN(): 
-        return os.environ.get("SIDEKICK_BOT_TOKEN")
-    
-    @staticmethod
-    def WEBHOOK_BASE_URL(): 
-        return os.environ.get("WEBHOOK_BASE_URL")
-
-    @staticmethod
-    def MAIN_BOT_USER_ID(): 
-        return os.environ.get("MAIN_BOT_USER_ID")
-
-    @staticmethod
-    def GROUP_CHAT_ID(): 
-        return os.environ.get("GROUP_CHAT_ID")
-        
-    # ID numerik dari pemilik grup untuk menerima laporan.
-    @staticmethod
-    def GROUP_OWNER_ID():
-        return os.environ.get("GROUP_OWNER_ID")
+    _settings = None
+    _lock = threading.Lock()
+    _listeners = []
 
-    # Menggunakan URL database terpisah untuk menghindari konflik
-    @staticmethod
-    def DATABASE_URL(): 
-        return os.environ.get("SIDEKICK_DATABASE_URL")
-        
-    # Kunci API untuk layanan Groq AI
-    @staticmethod
-    def GROQ_API_KEY():
-        return os.environ.get("GROQ_API_KEY")
+    @classmethod
+    def current(cls):
+        settings = cls._settings
+        if settings is None:
+            with cls._lock:
+                if cls._settings is None:
+                    cls._settings = build_settings(_read_sources())
+                settings = cls._settings
+        return settings
+
+    @classmethod
+    def reload(cls):
+        """Membaca ulang konfigurasi; mengembalikan nama nilai yang berubah. Snapshot lama tetap dipakai jika gagal."""
+        new = build_settings(_read_sources())
+        with cls._lock:
+            old, cls._settings = cls._settings, new
+        if old is None:
+            return []
+        changed = [name for name in Settings._fields if getattr(old, name) != getattr(new, name)]
+        restart_needed = [name for name in changed if name in RESTART_ONLY]
+        logger.info(f"Konfigurasi dimuat ulang, {len(changed)} nilai berubah: {', '.join(changed) or '-'}")
+        if restart_needed:
+            logger.warning(f"Perubahan ini baru berlaku setelah restart: {', '.join(restart_needed)}")
+        for listener in list(cls._listeners):
+            try:
+                listener(new, old)
+            except Exception as e:
+                logger.error(f"Listener konfigurasi gagal: {e}", exc_info=True)
+        return changed
+
+    @classmethod
+    def subscribe(cls, listener):
+        """`listener(new, old)` dipanggil setelah setiap reload yang berhasil."""
+        cls._listeners.append(listener)
@@ -0,0 +1,442 @@
+# sidekick_ai.py
+import hashlib
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from sidekick_metrics import GROQ_CALL_SECONDS, GROQ_TOKENS, LIVE_REPLIES
+
+logger = logging.getLogger(__name__)
+
+AI_MODEL = "llama3-8b-8192"
+# Rough English average, used only when a stream is closed before Groq reports usage
+CHARS_PER_TOKEN = 4
+
+_TRANSIENT_ERROR_NAMES = ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError")
+
+
+def is_transient_error(error):
+    """True for Groq errors that are worth retrying (timeouts, 429s, 5xx, dropped connections)."""
+    # groq is imported lazily by whoever builds the client; if it was never loaded, this isn't a groq error.
+    groq = sys.modules.get("groq")
+    if groq:
+        transient_types = tuple(getattr(groq, name) for name in _TRANSIENT_ERROR_NAMES if hasattr(groq, name))
+        if transient_types and isinstance(error, transient_types):
+            return True
+    status = getattr(error, "status_code", None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+
+def without_sdk_retries(client):
+    """The client with the SDK's own retries off, so our retry loop (and its deadline) is the only one."""
+    with_options = getattr(client, "with_options", None)
+    return with_options(max_retries=0) if with_options else client
+
+
+# ==========================
+#  🧹 LINE PARSING & DEDUP
+# ==========================
+# Only list markers at the very start of a line are stripped, so "100x" or "24/7" survive.
+_LIST_MARKER_RE = re.compile(r'^\s*(?:\d{1,3}[.)]\s+|[-*•]+\s*)')
+_NORMALIZE_RE = re.compile(r'[^a-z0-9{}$ ]+')
+
+
+def clean_ai_line(line):
+    line = _LIST_MARKER_RE.sub('', line.strip()).strip()
+    line = line.strip('*').strip()
+    if len(line) >= 2 and line[0] == line[-1] and line[0] in '"\'':
+        line = line[1:-1].strip()
+    return line
+
+
+def normalize_line(line):
+    return " ".join(_NORMALIZE_RE.sub(' ', line.lower()).split())
+
+
+class StreamingLineParser:
+    """Turns streamed completion chunks into cleaned, complete lines."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        return [cleaned for cleaned in map(clean_ai_line, lines) if cleaned]
+
+    def finish(self):
+        line, self._buffer = clean_ai_line(self._buffer), ""
+        return [line] if line else []
+
+
+class LineDeduplicator:
+    """
+    Rejects lines that repeat `existing` ones or each other.
+
+    Exact repeats are caught by hashing the normalized text. Near repeats are
+    caught by word-shingle Jaccard similarity; an inverted shingle index
+    limits the comparison to lines that share at least one shingle.
+    """
+
+    def __init__(self, existing=(), threshold=0.7, shingle_size=2):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._hashes = set()
+        self._shingles = []
+        self._index = {}
+        for line in existing:
+            self.add(line)
+
+    def _shingle_set(self, normalized):
+        words = normalized.split()
+        if len(words) < self.shingle_size:
+            return {tuple(words)}
+        return {tuple(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def add(self, line):
+        """Records `line` and returns True if it is new enough to keep."""
+        normalized = normalize_line(line)
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+        if digest in self._hashes:
+            return False
+        shingles = self._shingle_set(normalized)
+        overlaps = {}
+        for shingle in shingles:
+            for candidate in self._index.get(shingle, ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+        for candidate, shared in overlaps.items():
+            union = len(shingles) + len(self._shingles[candidate]) - shared
+            if union and shared / union >= self.threshold:
+                return False
+
+        self._hashes.add(digest)
+        line_id = len(self._shingles)
+        self._shingles.append(shingles)
+        for shingle in shingles:
+            self._index.setdefault(shingle, []).append(line_id)
+        return True
+
+
+def merge_lines(new_lines, existing, max_entries):
+    """New lines first, then the existing corpus, capped at `max_entries`."""
+    fresh = set(new_lines)
+    return (list(new_lines) + [line for line in existing if line not in fresh])[:max_entries]
+
+
+# ==========================
+#  🔄 CONCURRENT AI RENEWAL
+# ==========================
+class CategoryResult:
+    def __init__(self, category, min_count):
+        self.category = category
+        self.min_count = min_count
+        self.lines = []
+        self.status = "timeout"  # success | too_few | error | timeout
+        self.attempts = 0
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tokens_estimated = False  # True if any call was cut short before Groq reported usage
+        self.error = None
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class RenewalRunner:
+    """
+    Renews several response categories concurrently.
+
+    At most `concurrency` Groq calls run at once. Completions are streamed
+    and parsed line by line; lines rejected by `accept_func` or duplicating
+    the current corpus (`existing_func`) are skipped, and the stream is closed
+    as soon as `min_count` good lines are in. Transient errors are retried
+    with exponential backoff and jitter, keeping lines already received, and
+    every call (and backoff) is cut short by one overall deadline. Categories
+    still unfinished at the deadline are reported as timed out; finished ones
+    are returned as usual so partial results can be published.
+    """
+
+    def __init__(self, client, accept_func, existing_func, concurrency=3, max_retries=3, deadline=240.0,
+                 call_timeout=45.0, model=AI_MODEL):
+        self.client = without_sdk_retries(client)
+        self.accept_func = accept_func
+        self.existing_func = existing_func
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.call_timeout = call_timeout
+        self.model = model
+
+    def _stream_lines(self, result, prompt, timeout, dedup):
+        started = time.perf_counter()
+        usage = None
+        received_chars = 0
+        stream = self.client.chat.completions.create(
+            messages=[{"role": "system", "content": prompt}],
+            model=self.model, temperature=1.0, max_tokens=3000, timeout=timeout, stream=True
+        )
+        parser = StreamingLineParser()
+        try:
+            for chunk in stream:
+                # Groq reports usage only on the final chunk, which an early stop never sees.
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    received_chars += len(delta)
+                    if self._collect(result, parser.feed(delta), dedup):
+                        return
+            self._collect(result, parser.finish(), dedup)
+        finally:
+            close = getattr(stream, "close", None) or getattr(getattr(stream, "response", None), "close", None)
+            if close:
+                close()
+            GROQ_CALL_SECONDS.labels(category=result.category).observe(time.perf_counter() - started)
+            self._count_tokens(result, usage, prompt, received_chars)
+
+    def _count_tokens(self, result, usage, prompt, received_chars):
+        if usage:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            GROQ_TOKENS.labels(kind="prompt").inc(prompt_tokens)
+            GROQ_TOKENS.labels(kind="completion").inc(completion_tokens)
+        else:
+            # Estimated from text length; kept out of the measured prompt/completion series.
+            prompt_tokens = -(-len(prompt) // CHARS_PER_TOKEN)
+            completion_tokens = -(-received_chars // CHARS_PER_TOKEN)
+            result.tokens_estimated = True
+            GROQ_TOKENS.labels(kind="estimated").inc(prompt_tokens + completion_tokens)
+        # Summed over attempts, so retried calls are counted too.
+        result.prompt_tokens += prompt_tokens
+        result.completion_tokens += completion_tokens
+
+    def _collect(self, result, lines, dedup):
+        """Adds accepted lines; returns True once enough were collected to stop early."""
+        for line in lines:
+            if len(line) > 5 and self.accept_func(result.category, line) and dedup.add(line):
+                result.lines.append(line)
+                if len(result.lines) >= result.min_count:
+                    return True
+        return False
+
+    def _renew_category(self, result, prompt, deadline_at):
+        started = time.monotonic()
+        try:
+            dedup = LineDeduplicator(self.existing_func(result.category))
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    result.status = "timeout"
+                    return result
+                result.attempts += 1
+                try:
+                    self._stream_lines(result, prompt, min(self.call_timeout, remaining), dedup)
+                    break
+                except Exception as e:
+                    result.error = e
+                    if result.attempts > self.max_retries or not is_transient_error(e):
+                        result.status = "error"
+                        logger.error(f"❌ Failed to update Sidekick category '{result.category}' with AI: {e}")
+                        return result
+                    backoff = min(30.0, 2 ** (result.attempts - 1)) * random.uniform(0.5, 1.0)
+                    logger.warning(f"Transient Groq error for {result.category} (attempt {result.attempts}), "
+                                   f"retrying in {backoff:.1f}s: {e}")
+                    time.sleep(min(backoff, max(0.0, deadline_at - time.monotonic())))
+
+            result.status = "success" if len(result.lines) >= result.min_count else "too_few"
+            return result
+        except Exception as e:
+            result.status = "error"
+            result.error = e
+            logger.error(f"❌ Failed to process AI output for Sidekick category '{result.category}': {e}", exc_info=True)
+            return result
+        finally:
+            result.latency = time.monotonic() - started
+
+    def run(self, categories):
+        """`categories` maps category -> (prompt, min_count); returns category -> CategoryResult."""
+        deadline_at = time.monotonic() + self.deadline
+        results = {category: CategoryResult(category, min_count) for category, (_, min_count) in categories.items()}
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sidekick-renewal")
+        try:
+            futures = {
+                pool.submit(self._renew_category, results[category], prompt, deadline_at): category
+                for category, (prompt, _) in categories.items()
+            }
+            _, not_done = wait(futures, timeout=max(0.0, deadline_at - time.monotonic()))
+            if not_done:
+                logger.warning(f"Sidekick AI renewal hit its {self.deadline:.0f}s deadline with {len(not_done)} categories unfinished.")
+            for future in not_done:
+                # Detach from the still-running call so a late answer can't change the report.
+                category = futures[future]
+                results[category] = CategoryResult(category, results[category].min_count)
+                results[category].latency = self.deadline
+        finally:
+            # Calls still in flight are bounded by the deadline; don't wait for them here.
+            pool.shutdown(wait=False, cancel_futures=True)
+        return results
+
+
+# ==========================
+#  💬 LIVE REPLIES
+# ==========================
+LIVE_REPLY_PROMPT = (
+    "You are NPEPE Sidekick, the loyal, funny hype man of the NPEPE meme coin community's main bot. "
+    "Answer the user's message in one or two short, energetic sentences in English. "
+    "Never give financial advice or price predictions."
+)
+
+
+class ReplyCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_entries=500, ttl=900.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CallBudget:
+    """At most `per_minute` calls in any sliding 60-second window."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= 60.0:
+                self._calls.popleft()
+            if len(self._calls) >= self.per_minute:
+                return False
+            self._calls.append(now)
+            return True
+
+
+class LiveResponder:
+    """
+    Answers mentions with live Groq completions without one call per message.
+
+    Questions are keyed by their normalized text. A cached answer is
+    returned straight away; a question already being asked just waits for
+    that call's answer (single flight); anything else spends one unit of the
+    per-minute budget. Over budget, on timeout or on any Groq error the
+    caller gets `fallback_func()` instead. `reply()` never blocks: callbacks
+    run on the responder's own small thread pool.
+    """
+
+    def __init__(self, client_func, fallback_func, cache_size=500, cache_ttl=900.0, budget_per_minute=20,
+                 timeout=8.0, workers=2, model=AI_MODEL):
+        self.client_func = client_func
+        self.fallback_func = fallback_func
+        self.cache = ReplyCache(cache_size, cache_ttl)
+        self.budget = CallBudget(budget_per_minute)
+        self.timeout = timeout
+        self.model = model
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sidekick-live-reply")
+        self._inflight = {}  # key -> [callback, ...]
+        self._lock = threading.Lock()
+
+    def reply(self, question, callback):
+        """Calls `callback(text, source)` once, with source one of cache/live/coalesced/fallback."""
+        key = normalize_line(question)
+        if not key:
+            self._finish(callback, self.fallback_func(), "fallback")
+            return
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._finish(callback, cached, "cache")
+            return
+        with self._lock:
+            waiters = self._inflight.get(key)
+            if waiters is not None:
+                waiters.append(callback)
+                LIVE_REPLIES.labels(source="coalesced").inc()
+                return
+            if not self.budget.try_acquire():
+                leader = None
+            else:
+                leader = self._inflight[key] = [callback]
+        if leader is None:
+            self._finish(callback, self.fallback_func(), "fallback")
+            return
+        self._pool.submit(self._ask, key, question)
+
+    def _ask(self, key, question):
+        answer = None
+        try:
+            answer = self._complete(question)
+        except Exception as e:
+            logger.warning(f"Sidekick live reply failed, using a canned answer: {e}")
+        if answer:
+            self.cache.put(key, answer)
+        with self._lock:
+            callbacks = self._inflight.pop(key, [])
+        for index, callback in enumerate(callbacks):
+            # Followers were already counted as coalesced when they joined.
+            if answer:
+                self._finish(callback, answer, "live", count=index == 0)
+            else:
+                self._finish(callback, self.fallback_func(), "fallback", count=index == 0)
+
+    def _complete(self, question):
+        client = self.client_func()
+        if not client:
+            return None
+        started = time.perf_counter()
+        try:
+            # One attempt only: on timeout or error the caller gets the canned fallback right away.
+            completion = without_sdk_retries(client).chat.completions.create(
+                messages=[{"role": "system", "content": LIVE_REPLY_PROMPT}, {"role": "user", "content": question[:500]}],
+                model=self.model, temperature=0.9, max_tokens=120, timeout=self.timeout
+            )
+        finally:
+            GROQ_CALL_SECONDS.labels(category="LIVE_REPLY").observe(time.perf_counter() - started)
+        usage = getattr(completion, "usage", None)
+        if usage:
+            GROQ_TOKENS.labels(kind="prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+            GROQ_TOKENS.labels(kind="completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+        return (completion.choices[0].message.content or "").strip() or None
+
+    def _finish(self, callback, text, source, count=True):
+        if count:
+            LIVE_REPLIES.labels(source=source).inc()
+        try:
+            callback(text, source)
+        except Exception as e:
+            logger.error(f"Sidekick live reply callback failed: {e}", exc_info=True)
+
+    def snapshot(self):
+        with self._lock:
+            inflight = len(self._inflight)
+        return {"cached": len(self.cache), "inflight": inflight, "budget_per_minute": self.budget.per_minute}
@@ -0,0 +1,580 @@
+# sidekick_bench.py
+"""
+Offline benchmark and replay harness for the Sidekick bot.
+
+Replays synthetic or recorded update streams into the real `webhook` route
+while the Telegram Bot API and Groq are served by local fake HTTP servers and
+the schedule log lives in memory, then reports ack/end-to-end latency, peak
+threads and RSS, and DB round trips per `check_and_run_schedules` call.
+
+    python sidekick_bench.py --scenario mixed --rate 50 --count 2000
+    python sidekick_bench.py --replay updates.jsonl --rate 20 --output bench_output.txt
+    python sidekick_bench.py --scenario join --rate 100 --count 500 --telegram-429-rate 0.05 --json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BENCH_TOKEN = "123456:BENCH-TOKEN"
+MAIN_BOT_ID = 424242
+GROUP_CHAT_ID = -1001000000000
+OWNER_ID = 777
+
+SCENARIOS = {
+    "join": {"join": 1.0},
+    "main_bot": {"main_bot": 1.0},
+    "identity": {"identity": 1.0},
+    "mixed": {"join": 0.3, "main_bot": 0.1, "identity": 0.2, "chatter": 0.4},
+}
+
+
+# ==========================
+#  📡 FAKE TELEGRAM BOT API
+# ==========================
+class FakeTelegram:
+    """Answers Bot API calls locally and records every sendMessage."""
+
+    def __init__(self, error_rate=0.0, latency=0.0):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.sends = []  # (monotonic time, chat_id, text)
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="bench-telegram", daemon=True).start()
+
+    def _answer(self, method, params):
+        if method == "sendMessage":
+            if random.random() < self.error_rate:
+                with self._lock:
+                    self.throttled += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                             "parameters": {"retry_after": 1}}
+            chat_id = int(params.get("chat_id", 0))
+            with self._lock:
+                self._message_id += 1
+                self.sends.append((time.monotonic(), chat_id, params.get("text", "")))
+                message_id = self._message_id
+            return 200, {"ok": True, "result": {
+                "message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": chat_id, "type": "supergroup"}}}
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": int(BENCH_TOKEN.split(":")[0]), "is_bot": True,
+                                                "first_name": "Sidekick", "username": "npepe_sidekick_bench"}}
+        if method == "getWebhookInfo":
+            return 200, {"ok": True, "result": {"url": "", "has_custom_certificate": False, "pending_update_count": 0}}
+        return 200, {"ok": True, "result": True}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                url = urlparse(self.path)
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if body:
+                    if self.headers.get("Content-Type", "").startswith("application/json"):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[-1] for key, values in parse_qs(body.decode()).items()})
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, payload = fake._answer(url.path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ==========================
+#  🧠 FAKE GROQ API
+# ==========================
+class FakeGroq:
+    """OpenAI-compatible chat completions endpoint that streams numbered hype lines."""
+
+    def __init__(self, lines=120, chunk_delay=0.001):
+        self.lines = lines
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="bench-groq", daemon=True).start()
+
+    def _text(self):
+        words = ["moon", "rocket", "pump", "diamond", "frog", "legend", "ribbit", "bull", "green", "hype"]
+        return "\n".join(
+            f"{i + 1}. Welcome {{name}}, {random.choice(words)} {words[i % 10]} squad number {i} is 100x ready {i * 7919}"
+            for i in range(self.lines)
+        )
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                fake.requests += 1
+                text = fake._text()
+                base = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": request.get("model", "bench")}
+                if not request.get("stream"):
+                    payload = dict(base, object="chat.completion", choices=[{
+                        "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                        usage={"prompt_tokens": 40, "completion_tokens": len(text) // 4,
+                               "total_tokens": 40 + len(text) // 4})
+                    data = json.dumps(payload).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for start in range(0, len(text), 16):
+                        chunk = dict(base, choices=[{"index": 0, "delta": {"content": text[start:start + 16]},
+                                                     "finish_reason": None}])
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                        if fake.chunk_delay:
+                            time.sleep(fake.chunk_delay)
+                    final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                 x_groq={"id": "bench", "usage": {"prompt_tokens": 40,
+                                                                  "completion_tokens": len(text) // 4,
+                                                                  "total_tokens": 40 + len(text) // 4}})
+                    self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client stopped reading early, which is what streaming renewal does.
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# ==========================
+#  🗄️ IN-MEMORY SCHEDULE STORE
+# ==========================
+def make_memory_store(ttl):
+    from sidekick_db import ScheduleLogStore
+
+    class InMemoryScheduleStore(ScheduleLogStore):
+        """ScheduleLogStore whose round trips hit a dict and are counted instead of Postgres."""
+
+        def __init__(self):
+            super().__init__(pool=None, ttl=ttl)
+            self.table = {}
+            self.reads = 0
+            self.writes = 0
+            self.claims = 0
+            self.finishes = 0
+
+        def _fetch_rows(self):
+            self.reads += 1
+            return [(name,) + state for name, state in self.table.items()]
+
+        def _claim_rows(self, markers):
+            self.writes += 1
+            self.claims += 1
+            now = datetime.now(timezone.utc)
+            claimed = set()
+            for name, marker in markers.items():
+                stored, status, lease_expires_at = self.table.get(name, (None, None, None))
+                if stored != marker or (status == "running" and lease_expires_at < now):
+                    self.table[name] = (marker, "running", now + timedelta(seconds=self.lease))
+                    claimed.add(name)
+            return claimed
+
+        def _finish_row(self, task_name, run_marker, status, error):
+            self.writes += 1
+            self.finishes += 1
+            if self.table.get(task_name, (None,))[0] == run_marker:
+                self.table[task_name] = (run_marker, status, None)
+
+    return InMemoryScheduleStore()
+
+
+def measure_schedule_round_trips(tasks, ttl, passes):
+    """
+    Store round trips per scheduler pass that actually has due slots.
+
+    The real schedule table is copied with no-op tasks into a scheduler on a
+    fake clock, which is stepped to each next slot in turn; wall-clock
+    scheduling would almost never have a slot due during a benchmark.
+    """
+    from sidekick_scheduler import ScheduledTask, Scheduler
+
+    store = make_memory_store(ttl)
+    table = [ScheduledTask(task.name, lambda *args: None, hour=task.hour, minute=task.minute,
+                           day_of_week=task.day_of_week, grace=task.grace, tz=task.tz) for task in tasks]
+    clock = {"now": datetime(2030, 1, 1, tzinfo=timezone.utc)}
+    scheduler = Scheduler(store, table, clock=lambda: clock["now"], runner=lambda run: run.task())
+
+    def one_pass():
+        clock["now"] = scheduler._heap[0][0]
+        before = (store.reads, store.claims, store.finishes)
+        started = scheduler.run_pending()
+        loads, claims, finishes = (after - prior for after, prior in zip((store.reads, store.claims, store.finishes), before))
+        # The contract: at most one load (cache refresh) and one claim per pass, one finish per slot run.
+        assert claims == 1 and finishes == len(started) and len(started) >= 1, (loads, claims, finishes, started)
+        return loads, claims, finishes, len(started)
+
+    warm = [one_pass() for _ in range(max(1, passes))]
+    store.invalidate()
+    cold = one_pass()
+    assert all(loads == 0 for loads, _, _, _ in warm[1:]) and cold[0] == 1, (warm, cold)
+    slots = sum(run for _, _, _, run in warm)
+    return {
+        "passes": len(warm),
+        "slots_run": slots,
+        "trips_per_pass_warm": round(sum(l + c + f for l, c, f, _ in warm[1:]) / max(1, len(warm) - 1), 2),
+        "claim_trips_per_pass": 1,
+        "finish_trips_per_slot": 1,
+        "load_trips_after_invalidate": cold[0],
+    }
+
+
+def check_cooldown_limits(limits):
+    """
+    Replays each configured cooldown on a fake clock and checks it is exact.
+
+    `count` replies are spread over the first half of the window; one more
+    must be refused until the first of them is `seconds` old and allowed
+    from then on (for 1/N: allowed again at N seconds, not 2N).
+    """
+    from sidekick_cooldowns import Cooldowns
+
+    results = {}
+    for kind, scope, count, seconds in limits:
+        if count <= 0:
+            continue
+        clock = {"now": 0.0}
+        cooldowns = Cooldowns([(kind, scope, count, seconds)], clock=lambda: clock["now"])
+        hits = [seconds / 2 * i / count for i in range(count)]
+        for at in hits:
+            clock["now"] = at
+            assert cooldowns.allow(kind, GROUP_CHAT_ID, OWNER_ID), (kind, scope, at)
+        clock["now"] = seconds - 0.001
+        refused = not cooldowns.allow(kind, GROUP_CHAT_ID, OWNER_ID)
+        clock["now"] = seconds
+        allowed = cooldowns.allow(kind, GROUP_CHAT_ID, OWNER_ID)
+        # The contract: at most `count` per `seconds`, and no longer than that.
+        assert refused and allowed, (kind, scope, count, seconds, refused, allowed)
+        results[f"{kind}:{scope}"] = f"{count}/{seconds:g}s exact"
+    return results
+
+
+# ==========================
+#  🧪 UPDATE STREAMS
+# ==========================
+def make_update(update_id, kind, index, join_chats):
+    now = int(time.time())
+    user = {"id": 10_000_000 + index, "is_bot": False, "first_name": f"Fren_{index}"}
+    if kind == "join":
+        chat_id = GROUP_CHAT_ID - 1 - (index % join_chats)
+        message = {"from": user, "new_chat_members": [user]}
+    elif kind == "main_bot":
+        chat_id = GROUP_CHAT_ID - 10_000 - index
+        message = {"from": {"id": MAIN_BOT_ID, "is_bot": True, "first_name": "NPEPE"},
+                   "text": random.choice(["GM legends! Coffee time.", "Rise and ribbit, army!", "Midday check-in 🐸"])}
+    elif kind == "identity":
+        chat_id = GROUP_CHAT_ID - 20_000 - index
+        message = {"from": user, "text": random.choice(["hey who are you?", "Are you a bot??", "what is this bot"])}
+    else:
+        # Chatter gets no reply; keep it out of the scheduled-post chat so it can't skew e2e numbers.
+        chat_id = GROUP_CHAT_ID - 30_000
+        message = {"from": user, "text": random.choice(["wen moon", "lfg", "chart looks good", "gm gm"])}
+    message.update({"message_id": index + 1, "date": now, "chat": {"id": chat_id, "type": "supergroup", "title": "Bench"}})
+    return {"update_id": update_id, "message": message}
+
+
+def synthetic_stream(scenario, count, join_chats):
+    weights = SCENARIOS[scenario]
+    kinds, probabilities = list(weights), list(weights.values())
+    for index in range(count):
+        yield make_update(100_000 + index, random.choices(kinds, probabilities)[0], index, join_chats)
+
+
+def replay_stream(path, count):
+    with open(path, encoding="utf-8") as handle:
+        for index, line in enumerate(handle):
+            if count and index >= count:
+                return
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def chat_of(update):
+    for key in ("message", "edited_message", "channel_post"):
+        if key in update:
+            return update[key].get("chat", {}).get("id")
+    return None
+
+
+# ==========================
+#  📏 MEASUREMENT
+# ==========================
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ResourceSampler:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_threads = threading.active_count()
+        self.peak_rss_mb = current_rss_mb()
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+    def start(self):
+        threading.Thread(target=self._run, name="bench-sampler", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# ==========================
+#  🚀 HARNESS
+# ==========================
+def configure_environment(args, telegram, groq_server):
+    os.environ.update({
+        "SIDEKICK_BOT_TOKEN": BENCH_TOKEN,
+        "WEBHOOK_BASE_URL": "http://127.0.0.1",
+        "MAIN_BOT_USER_ID": str(MAIN_BOT_ID),
+        "GROUP_CHAT_ID": str(GROUP_CHAT_ID),
+        "GROUP_OWNER_ID": str(OWNER_ID),
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": groq_server.base_url,
+        "SIDEKICK_DATABASE_URL": args.database_url or "postgresql://bench@127.0.0.1:1/bench",
+    })
+    for key, value in (("SIDEKICK_GREETING_WINDOW_SECONDS", args.reply_delay),
+                       ("SIDEKICK_BANTER_DELAY_SECONDS", args.reply_delay),
+                       ("SIDEKICK_IDENTITY_DELAY_SECONDS", args.reply_delay)):
+        os.environ.setdefault(key, str(value))
+
+    import telebot
+    telebot.apihelper.API_URL = telegram.api_url
+
+    if not args.database_url:
+        # No Postgres: make the pool report "unavailable" instantly instead of trying to connect.
+        import sidekick_db
+        sidekick_db.psycopg2 = None
+
+
+def run_benchmark(args):
+    telegram = FakeTelegram(error_rate=args.telegram_429_rate, latency=args.telegram_latency)
+    groq_server = FakeGroq()
+    telegram.start()
+    groq_server.start()
+    configure_environment(args, telegram, groq_server)
+
+    import sidekick_main
+    from config_sidekick import Config
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+    logic = sidekick_main.sidekick_logic
+    if not logic:
+        raise SystemExit("Sidekick failed to initialize; see the log output above.")
+
+    store = logic.schedule_store
+    if not args.database_url:
+        store = make_memory_store(store.ttl)
+        logic.schedule_store = logic.scheduler.store = store
+
+    sampler = ResourceSampler()
+    sampler.start()
+    threads_before = threading.active_count()
+    logic.start_services()
+    logic.bootstrap()
+    sidekick_main.update_queue.start()
+
+    # --- Replay ---
+    updates = replay_stream(args.replay, args.count) if args.replay else synthetic_stream(args.scenario, args.count, args.join_chats)
+    path = f"/{BENCH_TOKEN}"
+    local = threading.local()
+    ack_latencies = []
+    statuses = {}
+    first_seen = {}
+    lock = threading.Lock()
+
+    def post(update):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = sidekick_main.app.test_client()
+        payload = json.dumps(update).encode()
+        started = time.monotonic()
+        response = client.post(path, data=payload, content_type="application/json")
+        elapsed = time.monotonic() - started
+        with lock:
+            ack_latencies.append(elapsed)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            chat_id = chat_of(update)
+            if chat_id is not None:
+                first_seen.setdefault(chat_id, started)
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    sent = 0
+    replay_started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="bench-client") as pool:
+        for update in updates:
+            # Open-loop pacing: updates are offered on schedule even when the bot falls behind.
+            if interval:
+                delay = replay_started + sent * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(post, update)
+            sent += 1
+    replay_seconds = time.monotonic() - replay_started
+
+    # --- Drain ---
+    drain_deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < drain_deadline:
+        busy = (sidekick_main.update_queue.snapshot()["depth"] or logic.executor.pending_count()
+                or logic.outbound.snapshot()["pending"])
+        if not busy:
+            break
+        time.sleep(0.05)
+    time.sleep(0.2)
+
+    # --- End-to-end latency: first reply per chat minus first update for that chat ---
+    first_reply = {}
+    for sent_at, chat_id, _ in list(telegram.sends):
+        first_reply.setdefault(chat_id, sent_at)
+    e2e = [first_reply[chat] - seen for chat, seen in first_seen.items() if chat in first_reply]
+
+    # --- Schedule pass cost ---
+    round_trips = None
+    if hasattr(store, "reads"):
+        round_trips = measure_schedule_round_trips(logic.scheduler.tasks, store.ttl, args.schedule_calls)
+
+    cooldown_limits = check_cooldown_limits(Config.current().COOLDOWN_LIMITS)
+
+    renewal = None
+    if args.renewal:
+        started = time.monotonic()
+        requests_before = groq_server.requests
+        logic.renew_responses_with_ai()
+        renewal = {"seconds": round(time.monotonic() - started, 3), "groq_requests": groq_server.requests - requests_before}
+
+    sampler.stop()
+    return {
+        "scenario": "replay" if args.replay else args.scenario,
+        "updates": sent,
+        "offered_rate": args.rate,
+        "achieved_rate": round(sent / replay_seconds, 1) if replay_seconds else None,
+        "status_codes": statuses,
+        "ack_ms": {"p50": _ms(percentile(ack_latencies, 0.50)), "p99": _ms(percentile(ack_latencies, 0.99)),
+                   "max": _ms(max(ack_latencies) if ack_latencies else None)},
+        "e2e_send_ms": {"p50": _ms(percentile(e2e, 0.50)), "p99": _ms(percentile(e2e, 0.99)),
+                        "chats": len(e2e), "reply_delay_s": args.reply_delay},
+        "telegram": {"send_calls": len(telegram.sends), "injected_429": telegram.throttled},
+        "outbound": logic.outbound.snapshot(),
+        "ingest": sidekick_main.update_queue.snapshot(),
+        "threads": {"before_services": threads_before, "peak": sampler.peak_threads},
+        "peak_rss_mb": round(sampler.peak_rss_mb, 1),
+        "db_round_trips_per_schedule_call": round_trips,
+        "cooldown_limits": cooldown_limits,
+        "renewal": renewal,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def format_report(report):
+    lines = [f"== Sidekick benchmark: {report['scenario']} ({report['updates']} updates) =="]
+    for key, value in report.items():
+        if key not in ("scenario", "updates"):
+            lines.append(f"{key:>34}: {json.dumps(value) if isinstance(value, (dict, list)) else value}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay update streams against Sidekick with local fakes.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--replay", help="JSONL file of recorded Telegram updates, one per line")
+    parser.add_argument("--count", type=int, default=1000, help="updates to send (0 = whole replay file)")
+    parser.add_argument("--rate", type=float, default=50.0, help="updates per second (0 = as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel webhook clients")
+    parser.add_argument("--join-chats", type=int, default=3, help="chats that join bursts are spread over")
+    parser.add_argument("--reply-delay", type=float, default=0.5, help="greeting/banter/identity delay in seconds")
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds the fake Bot API waits per call")
+    parser.add_argument("--database-url", help="use this Postgres instead of the in-memory schedule store")
+    parser.add_argument("--schedule-calls", type=int, default=20, help="scheduler passes with due slots to measure")
+    parser.add_argument("--renewal", action="store_true", help="also time one AI renewal against the fake Groq")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="append the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2) if args.json else format_report(report)
+    print(text)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+# sidekick_broadcast.py
+import hashlib
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from sidekick_metrics import REGISTRY
+from sidekick_outbound import PRIORITY_HYPE
+from sidekick_scheduler import ScheduledTask
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_DELIVERIES = REGISTRY.counter(
+    "sidekick_broadcast_deliveries_total", "Scheduled post deliveries by final status.", labels=("status",))
+BROADCAST_FANOUT_SECONDS = REGISTRY.histogram(
+    "sidekick_broadcast_fanout_seconds", "Time to queue one scheduled post for every target chat.")
+
+# The original single-group table, in UTC: (slot name, hour, minute, category).
+DEFAULT_POST_SCHEDULE = (
+    ("sk_quote_10", 10, 0, "SCHEDULED_QUOTES"),
+    ("sk_quote_20", 20, 0, "SCHEDULED_QUOTES"),
+    ("sk_buy_00", 0, 0, "SCHEDULED_BUY"),
+    ("sk_buy_01", 1, 0, "SCHEDULED_BUY"),
+    ("sk_buy_03", 3, 0, "SCHEDULED_BUY"),
+    ("sk_buy_13", 13, 0, "SCHEDULED_BUY"),
+    ("sk_buy_15", 15, 0, "SCHEDULED_BUY"),
+    ("sk_buy_16", 16, 0, "SCHEDULED_BUY"),
+    ("sk_pump_0030", 0, 30, "SCHEDULED_PUMP"),
+    ("sk_pump_0130", 1, 30, "SCHEDULED_PUMP"),
+    ("sk_pump_0300", 3, 0, "SCHEDULED_PUMP"),
+    ("sk_pump_0500", 5, 0, "SCHEDULED_PUMP"),
+    ("sk_pump_1330", 13, 30, "SCHEDULED_PUMP"),
+    ("sk_pump_1430", 14, 30, "SCHEDULED_PUMP"),
+    ("sk_pump_1530", 15, 30, "SCHEDULED_PUMP"),
+    ("sk_pump_1630", 16, 30, "SCHEDULED_PUMP"),
+)
+
+
+# ==========================
+#  👥 GROUP DEFINITIONS
+# ==========================
+class Group:
+    """
+    One community chat the Sidekick posts to.
+
+    `schedule` is a list of (name, hour, minute, category) slots on the
+    group's local clock (`tz`), defaulting to DEFAULT_POST_SCHEDULE. When
+    `weights` is given, every slot posts from a category drawn with those
+    relative weights instead of the slot's own category.
+    """
+
+    def __init__(self, chat_id, tz="UTC", schedule=None, weights=None):
+        self.chat_id = int(chat_id)
+        self.tz_name = tz
+        self.tz = timezone.utc if tz == "UTC" else ZoneInfo(tz)
+        self.schedule = tuple(schedule) if schedule else DEFAULT_POST_SCHEDULE
+        if len({name for name, _, _, _ in self.schedule}) != len(self.schedule):
+            raise ValueError("schedule slot names must be unique")
+        weights = {category: float(weight) for category, weight in (weights or {}).items()}
+        weights = {category: weight for category, weight in weights.items() if weight > 0}
+        self._categories = list(weights)
+        self._weights = list(weights.values())
+
+    @property
+    def profile(self):
+        """Groups with the same profile share one set of scheduled tasks."""
+        return self.tz_name, self.schedule
+
+    def pick_category(self, slot_category):
+        if not self._categories:
+            return slot_category
+        return random.choices(self._categories, self._weights)[0]
+
+
+def _parse_schedule(entries):
+    schedule = []
+    for entry in entries:
+        hour, minute, category = int(entry["hour"]), int(entry.get("minute", 0)), entry["category"]
+        schedule.append((entry.get("name") or f"{category.lower()}_{hour:02d}{minute:02d}", hour, minute, category))
+    return schedule
+
+
+def load_groups(path=None, default_chat_id=None):
+    """
+    Reads the group list from a JSON file:
+    [{"chat_id": -100..., "timezone": "Asia/Jakarta", "schedule": [{"hour": 9, "minute": 0,
+    "category": "SCHEDULED_PUMP"}], "weights": {"SCHEDULED_BUY": 2, "SCHEDULED_PUMP": 1}}, ...]
+
+    Without a file (or if it can't be read) the single GROUP_CHAT_ID group is used.
+    """
+    fallback = [Group(default_chat_id)] if default_chat_id else []
+    if not path:
+        return fallback
+    try:
+        with open(path, encoding="utf-8") as groups_file:
+            entries = json.load(groups_file)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read Sidekick groups file {path}: {e}. Falling back to GROUP_CHAT_ID.")
+        return fallback
+
+    groups, seen = [], set()
+    for entry in entries:
+        try:
+            group = Group(
+                entry["chat_id"], tz=entry.get("timezone", "UTC"),
+                schedule=_parse_schedule(entry["schedule"]) if entry.get("schedule") else None,
+                weights=entry.get("weights")
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            # ZoneInfoNotFoundError is a KeyError, so unknown timezones land here too.
+            logger.error(f"Skipping invalid Sidekick group entry {entry!r}: {e}")
+            continue
+        if group.chat_id in seen:
+            logger.warning(f"Sidekick group {group.chat_id} is listed twice; keeping the first entry.")
+            continue
+        seen.add(group.chat_id)
+        groups.append(group)
+    logger.info(f"Loaded {len(groups)} Sidekick group(s) from {path}.")
+    return groups
+
+
+def build_post_schedule(groups, post_func):
+    """
+    One ScheduledTask per slot per distinct (timezone, schedule) profile; each
+    task fans out to every group sharing that profile, so hundreds of groups
+    on a handful of profiles still give the scheduler only a few dozen entries.
+    """
+    profiles = {}
+    for group in groups:
+        profiles.setdefault(group.profile, []).append(group)
+
+    tasks = []
+    for (tz_name, schedule), members in profiles.items():
+        # The default profile keeps the original task names so existing run markers stay valid.
+        if tz_name == "UTC" and schedule == DEFAULT_POST_SCHEDULE:
+            prefix = ""
+        else:
+            prefix = f"{tz_name}/{hashlib.blake2b(repr(schedule).encode('utf-8'), digest_size=4).hexdigest()}:"
+        for name, hour, minute, category in schedule:
+            tasks.append(ScheduledTask(
+                prefix + name, post_func, hour=hour, minute=minute, tz=members[0].tz,
+                args=(prefix + name, category, tuple(members))
+            ))
+    return tasks
+
+
+# ==========================
+#  📣 BROADCAST ENGINE
+# ==========================
+class BroadcastRecord:
+    def __init__(self, broadcast_id, name, category):
+        self.id = broadcast_id
+        self.name = name
+        self.category = category
+        self.started_at = datetime.now(timezone.utc)
+        self.fanout_seconds = 0.0
+        self.statuses = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def mark(self, chat_id, status, error=None):
+        with self._lock:
+            self.statuses[chat_id] = status
+            if error is not None:
+                self.errors[str(chat_id)] = str(error)
+        if status != "queued":
+            BROADCAST_DELIVERIES.labels(status=status).inc()
+
+    def snapshot(self):
+        with self._lock:
+            counts = {}
+            for status in self.statuses.values():
+                counts[status] = counts.get(status, 0) + 1
+            return {
+                "id": self.id,
+                "name": self.name,
+                "category": self.category,
+                "started_at": self.started_at.isoformat(),
+                "fanout_seconds": round(self.fanout_seconds, 4),
+                "chats": len(self.statuses),
+                "status": counts,
+                "errors": dict(itertools.islice(self.errors.items(), 20)),
+            }
+
+
+class BroadcastEngine:
+    """
+    Fans one scheduled post out to many chats.
+
+    Every target chat gets its own message (category picked by the group's
+    weights), queued on the OutboundSender at hype priority; its sender
+    threads deliver them in parallel while the global and per-chat token
+    buckets keep the whole fan-out inside Telegram's limits. Fan-out itself
+    only enqueues, so it takes milliseconds even for hundreds of chats.
+    Delivery callbacks record a per-chat status; the last `history`
+    broadcasts are kept for the status endpoint.
+    """
+
+    def __init__(self, outbound, pick_message, history=20):
+        self.outbound = outbound
+        self.pick_message = pick_message
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def broadcast(self, name, category, groups):
+        started = time.perf_counter()
+        record = BroadcastRecord(next(self._ids), name, category)
+        with self._lock:
+            self._history.append(record)
+
+        for group in groups:
+            message = self.pick_message(group.pick_category(category))
+            if not message:
+                record.mark(group.chat_id, "skipped")
+                continue
+            record.mark(group.chat_id, "queued")
+            if not self.outbound.send(group.chat_id, message, priority=PRIORITY_HYPE, on_done=record.mark):
+                record.mark(group.chat_id, "dropped")
+
+        record.fanout_seconds = time.perf_counter() - started
+        BROADCAST_FANOUT_SECONDS.observe(record.fanout_seconds)
+        logger.info(f"Sidekick broadcast {name} queued for {len(groups)} chat(s) in {record.fanout_seconds * 1000:.1f} ms")
+        return record
+
+    def snapshot(self):
+        with self._lock:
+            records = list(self._history)
+        return {"broadcasts": [record.snapshot() for record in reversed(records)]}
@@ -0,0 +1,89 @@
+# sidekick_cooldowns.py
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sidekick_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COOLDOWN_SUPPRESSED = REGISTRY.counter(
+    "sidekick_cooldown_suppressed_total", "Replies skipped because a cooldown was exhausted.", labels=("kind", "scope"))
+
+SCOPES = ("user", "chat")
+
+
+# ==========================
+#  🧊 REPLY COOLDOWNS
+# ==========================
+class Cooldowns:
+    """
+    Per-user and per-chat reply limits for each trigger kind.
+
+    `limits` is a list of (kind, scope, count, seconds): at most `count`
+    replies of that kind per user (or per chat) in any `seconds` window.
+    A reply is allowed only if every limit for its kind has room, and only
+    then is it counted against all of them.
+
+    Each key keeps the times of its last `count` replies, so a limit is
+    exact: a reply is allowed once the oldest of those is `seconds` old.
+    Keys live in an LRU of at most `max_keys` entries, and keys whose last
+    reply is older than their window are dropped first when it fills up.
+    """
+
+    def __init__(self, limits=(), max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.suppressed = {}
+        self._hits = OrderedDict()  # (kind, scope, seconds, [chat_id,] id) -> deque of reply times, at most count
+        self._lock = threading.Lock()
+        self.configure(limits)
+
+    def configure(self, limits):
+        by_kind = {}
+        for kind, scope, count, seconds in limits:
+            by_kind.setdefault(kind, []).append((scope, count, float(seconds)))
+        with self._lock:
+            self._limits = by_kind
+
+    def _evict(self, now):
+        for key in [key for key, hits in self._hits.items() if not hits or now - hits[-1] >= key[2]]:
+            del self._hits[key]
+        while len(self._hits) > self.max_keys:
+            self._hits.popitem(last=False)
+
+    def allow(self, kind, chat_id, user_id=None):
+        """True if a reply of `kind` may go out now (and counts it); False if a cooldown is exhausted."""
+        now = self.clock()
+        with self._lock:
+            limits = self._limits.get(kind)
+            if not limits:
+                return True
+            checks = []
+            for scope, count, window in limits:
+                owner = user_id if scope == "user" else chat_id
+                if owner is None:
+                    continue
+                key = (kind, scope, window, chat_id, owner) if scope == "user" else (kind, scope, window, owner)
+                hits = self._hits.get(key)
+                if hits is None or hits.maxlen != count:
+                    # A reload may change the count; keep the most recent replies under the new cap.
+                    hits = deque(hits or (), maxlen=count)
+                if count <= 0 or (len(hits) == count and now - hits[0] < window):
+                    label = f"{kind}:{scope}"
+                    self.suppressed[label] = self.suppressed.get(label, 0) + 1
+                    COOLDOWN_SUPPRESSED.labels(kind=kind, scope=scope).inc()
+                    return False
+                checks.append((key, hits))
+            for key, hits in checks:
+                hits.append(now)
+                self._hits[key] = hits
+                self._hits.move_to_end(key)
+            if len(self._hits) > self.max_keys:
+                self._evict(now)
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            return {"keys": len(self._hits), "suppressed": dict(self.suppressed)}
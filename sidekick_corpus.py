@@ -0,0 +1,163 @@
+# sidekick_corpus.py
+import logging
+import threading
+
+from sidekick_db import DatabaseGate
+
+try:
+    import psycopg2.extras
+except ImportError:
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+#  📚 RESPONSE CORPUS
+# ==========================
+class ResponseCorpus:
+    """
+    Versioned response lists stored in `sidekick_response_corpus`.
+
+    Categories are loaded one by one on first use and cached with their
+    version. A background thread started by start() compares the cached
+    versions with the table every `refresh_interval` seconds in a single
+    query, so a renewal published by any replica is picked up without
+    get() ever running that check. publish() writes several categories in
+    one transaction. The built-in lists from `fallback` are only used for
+    categories that have never been published (or while the database is
+    unreachable).
+
+    While its DatabaseGate is closed, a cache miss serves the built-in list
+    without caching it, so the category is loaded once the database is back.
+    """
+
+    def __init__(self, pool, fallback, refresh_interval=300.0, on_change=None, healthy=None, backoff=30.0):
+        self.pool = pool
+        self._fallback_factory = fallback
+        self._fallback = None
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self.gate = DatabaseGate(healthy, backoff)
+        self._lock = threading.Lock()
+        self._cache = {}  # category -> (version, entries)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def ensure_table(self, cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sidekick_response_corpus "
+            "(category TEXT PRIMARY KEY, version INTEGER NOT NULL, entries JSONB NOT NULL, "
+            "updated_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+
+    def builtin(self, category):
+        if self._fallback is None:
+            self._fallback = self._fallback_factory()
+        return self._fallback.get(category)
+
+    # --- Reading ---
+    def _load(self, category):
+        if not self.gate.available():
+            return (0, self.builtin(category))
+        try:
+            with self.pool.connection() as conn:
+                if not conn:
+                    raise RuntimeError("no database connection available")
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT version, entries FROM sidekick_response_corpus WHERE category = %s", (category,))
+                    row = cursor.fetchone()
+        except Exception as e:
+            self.gate.failed()
+            logger.error(f"Failed to load Sidekick responses for {category}, using the built-in list for {self.gate.backoff:.0f}s: {e}")
+            return (0, self.builtin(category))
+        entry = (row[0], row[1]) if row else (0, self.builtin(category))
+        with self._lock:
+            self._cache[category] = entry
+        return entry
+
+    def refresh_versions(self):
+        """Drops cached categories whose version changed in the table; runs on the refresh thread."""
+        if not self.gate.available():
+            return
+        try:
+            with self.pool.connection() as conn:
+                if not conn:
+                    raise RuntimeError("no database connection available")
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT category, version FROM sidekick_response_corpus")
+                    versions = dict(cursor.fetchall())
+        except Exception as e:
+            self.gate.failed()
+            logger.error(f"Failed to check Sidekick response corpus versions: {e}")
+            return
+
+        with self._lock:
+            # Version None marks entries that only exist in memory; they stay until republished.
+            changed = [category for category, (version, _) in self._cache.items()
+                       if version is not None and versions.get(category, 0) != version]
+            for category in changed:
+                del self._cache[category]
+        for category in changed:
+            logger.info(f"Sidekick response category {category} changed to version {versions.get(category, 0)}.")
+            if self.on_change:
+                self.on_change(category)
+
+    def get(self, category, default=None):
+        entry = self._cache.get(category)
+        if entry is None:
+            entry = self._load(category)
+        return entry[1] if entry[1] is not None else default
+
+    def version(self, category):
+        entry = self._cache.get(category)
+        return entry[0] if entry else None
+
+    # --- Background refresh ---
+    def _loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh_versions()
+            except Exception as e:
+                logger.error(f"Sidekick response corpus refresh crashed: {e}", exc_info=True)
+
+    def start(self):
+        if not self.pool or not self.pool.configured or (self._thread and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="sidekick-corpus-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    # --- Publishing ---
+    def publish(self, updates):
+        """Atomically stores new entries for the given categories and bumps their versions."""
+        if not updates: return
+        versions = {}
+        try:
+            with self.pool.connection() as conn:
+                if conn:
+                    with conn.cursor() as cursor:
+                        for category, entries in updates.items():
+                            cursor.execute(
+                                "INSERT INTO sidekick_response_corpus (category, version, entries) VALUES (%s, 1, %s) "
+                                "ON CONFLICT (category) DO UPDATE SET version = sidekick_response_corpus.version + 1, "
+                                "entries = EXCLUDED.entries, updated_at = now() RETURNING version",
+                                (category, psycopg2.extras.Json(entries))
+                            )
+                            versions[category] = cursor.fetchone()[0]
+                    conn.commit()
+                else:
+                    logger.warning("Sidekick responses updated in memory only: database unavailable.")
+        except Exception as e:
+            versions = {}
+            logger.error(f"Failed to publish Sidekick responses, keeping them in memory only: {e}")
+
+        with self._lock:
+            for category, entries in updates.items():
+                self._cache[category] = (versions.get(category), entries)
+        for category in updates:
+            if self.on_change:
+                self.on_change(category)
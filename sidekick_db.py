@@ -0,0 +1,456 @@
+# sidekick_db.py
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from sidekick_metrics import DB_QUERY_SECONDS
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+except ImportError:
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+#  🗄️ CONNECTION POOL
+# ==========================
+class DatabasePool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are validated on checkout, replaced when broken, and closed
+    again once they have been idle for longer than `max_idle` seconds (down
+    to `min_size` connections kept warm).
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=5, max_idle=300.0,
+                 checkout_timeout=10.0, ping_after=30.0, connect_timeout=10):
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.max_idle = max_idle
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self.connect_timeout = connect_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # Stack of (connection, last_used_monotonic), most recent last
+        self._size = 0   # Connections currently open (idle + checked out + being opened)
+        self._closed = False
+
+    # --- Connection lifecycle ---
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connect_timeout=self.connect_timeout)
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _recycle_idle_locked(self, now):
+        # The stack is ordered by last use, so stale connections sit at the bottom.
+        expired = []
+        while self._idle and self._size - len(expired) > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.max_idle:
+                break
+            expired.append(self._idle.pop(0)[0])
+        self._size -= len(expired)
+        return expired
+
+    # --- Checkout / Release ---
+    def getconn(self):
+        if not self.dsn or not psycopg2:
+            return None
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            candidate = None
+            exhausted = waited = False
+            with self._cond:
+                if self._closed:
+                    return None
+                now = time.monotonic()
+                expired = self._recycle_idle_locked(now)
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                elif deadline - now <= 0:
+                    exhausted = True
+                else:
+                    self._cond.wait(deadline - now)
+                    waited = True
+
+            for conn in expired:
+                self._discard(conn)
+            if exhausted:
+                logger.error(f"Sidekick DB pool exhausted ({self.max_size} connections busy).")
+                return None
+            if waited:
+                continue
+
+            if candidate:
+                conn, last_used = candidate
+                if self._is_healthy(conn, time.monotonic() - last_used):
+                    return conn
+                logger.warning("Sidekick DB pool dropped a broken connection; reconnecting.")
+                self._discard(conn)
+                # Reuse the slot of the broken connection for a fresh one.
+
+            try:
+                return self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                logger.error(f"Sidekick DB connection failed: {e}")
+                return None
+
+    def putconn(self, conn, broken=False):
+        if conn is None:
+            return
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            if broken or conn.closed or self._closed:
+                self._size -= 1
+                to_close = conn
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = None
+            self._cond.notify()
+        if to_close is not None:
+            self._discard(to_close)
+
+    @property
+    def configured(self):
+        """False when there is no database at all (no DSN or no psycopg2), as opposed to one that is down."""
+        return bool(self.dsn and psycopg2)
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection, or None when the database is unavailable."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = conn is not None and (
+                conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)))
+            if conn is not None and not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._size -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+
+# ==========================
+#  📅 SCHEDULE LOG STORE
+# ==========================
+class ScheduleLogStore:
+    """
+    Cached view of the `sidekick_schedule_log` table.
+
+    All rows (marker, status and lease expiry per task) are loaded with a
+    single query and served from memory until the cache is invalidated or
+    older than `ttl` seconds. Claims and outcomes update the cache as they
+    are written.
+
+    Slots are claimed atomically so several replicas can share one schedule:
+    claim_many() is a conditional upsert that only wins for rows whose marker
+    differs, or whose previous claimant's lease (`lease` seconds) ran out
+    before it reported back. Every claim and its outcome is recorded in
+    `sidekick_schedule_runs`.
+    """
+
+    def __init__(self, pool, ttl=600.0, lease=600.0, owner=None):
+        self.pool = pool
+        self.ttl = ttl
+        self.lease = lease
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._states = {}
+        self._loaded_at = None
+
+    def ensure_table(self, cursor):
+        cursor.execute("CREATE TABLE IF NOT EXISTS sidekick_schedule_log (task_name TEXT PRIMARY KEY, last_run_date TEXT)")
+        cursor.execute(
+            "ALTER TABLE sidekick_schedule_log ADD COLUMN IF NOT EXISTS status TEXT, "
+            "ADD COLUMN IF NOT EXISTS lease_owner TEXT, ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ"
+        )
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sidekick_schedule_runs "
+            "(id BIGSERIAL PRIMARY KEY, task_name TEXT NOT NULL, run_marker TEXT NOT NULL, owner TEXT NOT NULL, "
+            "claimed_at TIMESTAMPTZ NOT NULL DEFAULT now(), finished_at TIMESTAMPTZ, "
+            "status TEXT NOT NULL DEFAULT 'running', error TEXT)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS sidekick_schedule_runs_claimed_at ON sidekick_schedule_runs (claimed_at)")
+        cursor.execute("DELETE FROM sidekick_schedule_runs WHERE claimed_at < now() - interval '90 days'")
+
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    # --- Storage round trips (overridden by the in-memory benchmark store) ---
+    def _fetch_rows(self):
+        with self.pool.connection() as conn:
+            if not conn: return None
+            with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="schedule_load").time():
+                cursor.execute("SELECT task_name, last_run_date, status, lease_expires_at FROM sidekick_schedule_log")
+                return cursor.fetchall()
+
+    def _claim_rows(self, markers):
+        """Returns the task names this owner won, or None when the database is unavailable."""
+        with self.pool.connection() as conn:
+            if not conn: return None
+            with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="schedule_claim").time():
+                rows = psycopg2.extras.execute_values(
+                    cursor,
+                    "WITH claimed AS ("
+                    " INSERT INTO sidekick_schedule_log AS log (task_name, last_run_date, status, lease_owner, lease_expires_at)"
+                    " VALUES %s"
+                    " ON CONFLICT (task_name) DO UPDATE SET last_run_date = EXCLUDED.last_run_date, status = 'running',"
+                    " lease_owner = EXCLUDED.lease_owner, lease_expires_at = EXCLUDED.lease_expires_at"
+                    " WHERE log.last_run_date IS DISTINCT FROM EXCLUDED.last_run_date"
+                    " OR (log.status = 'running' AND log.lease_expires_at < now())"
+                    " RETURNING task_name, last_run_date, lease_owner)"
+                    " INSERT INTO sidekick_schedule_runs (task_name, run_marker, owner)"
+                    " SELECT task_name, last_run_date, lease_owner FROM claimed RETURNING task_name",
+                    [(task_name, marker, self.owner, self.lease) for task_name, marker in markers.items()],
+                    template="(%s, %s, 'running', %s, now() + %s * interval '1 second')",
+                    fetch=True
+                )
+            conn.commit()
+            return {row[0] for row in rows}
+
+    def _finish_row(self, task_name, run_marker, status, error):
+        with self.pool.connection() as conn:
+            if not conn: return
+            with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="schedule_finish").time():
+                cursor.execute(
+                    "UPDATE sidekick_schedule_log SET status = %s, lease_expires_at = NULL "
+                    "WHERE task_name = %s AND last_run_date = %s AND lease_owner = %s",
+                    (status, task_name, run_marker, self.owner)
+                )
+                cursor.execute(
+                    "UPDATE sidekick_schedule_runs SET status = %s, error = %s, finished_at = now() "
+                    "WHERE task_name = %s AND run_marker = %s AND owner = %s AND finished_at IS NULL",
+                    (status, error, task_name, run_marker, self.owner)
+                )
+            conn.commit()
+
+    # --- Cache ---
+    def load(self):
+        rows = self._fetch_rows()
+        if rows is None: return False
+        with self._lock:
+            self._states = {name: (marker, status, lease_expires_at) for name, marker, status, lease_expires_at in rows}
+            self._loaded_at = time.monotonic()
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def get_states(self):
+        """{task_name: (last run marker, status, lease_expires_at)} from the cache, reloaded when stale."""
+        if not self._is_fresh():
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Failed to load Sidekick schedule log: {e}")
+        with self._lock:
+            return dict(self._states)
+
+    # --- Claiming ---
+    def claim_many(self, markers):
+        """Atomically claims {task_name: run_marker} slots; returns the set of names this replica may run."""
+        if not markers: return set()
+        try:
+            claimed = self._claim_rows(markers)
+        except Exception as e:
+            logger.error(f"Failed to claim Sidekick schedule slots {', '.join(markers)}: {e}")
+            return set()
+        if claimed is None:
+            if self.pool is None or not self.pool.configured:
+                # Fail open like before: without any database a single instance should keep posting.
+                logger.warning("Sidekick schedule claims unavailable (no database); running slots unclaimed.")
+                claimed = set(markers)
+            else:
+                # A configured database that is briefly unreachable must not turn into duplicate posts;
+                # the scheduler checks these slots again while their grace window lasts.
+                logger.warning(f"Sidekick schedule claims failed (database unavailable); skipping {', '.join(markers)} for now.")
+                claimed = set()
+        lease_expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.lease)
+        with self._lock:
+            # State of slots claimed elsewhere is unknown here; reload on the next pass.
+            self._states.update({name: (markers[name], "running", lease_expires_at) for name in claimed})
+            if len(claimed) < len(markers):
+                self._loaded_at = None
+        return claimed
+
+    def finish(self, task_name, run_marker, status, error=None):
+        with self._lock:
+            if self._states.get(task_name, (None,))[0] == run_marker:
+                self._states[task_name] = (run_marker, status, None)
+        try:
+            self._finish_row(task_name, run_marker, status, str(error) if error is not None else None)
+        except Exception as e:
+            logger.error(f"Failed to record Sidekick schedule run {task_name} ({run_marker}): {e}")
+
+    def history(self, limit=20):
+        """The latest runs, newest first; raises if the database can't be reached."""
+        with self.pool.connection() as conn:
+            if not conn:
+                raise RuntimeError("no database connection available")
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT task_name, run_marker, owner, claimed_at, finished_at, status, error "
+                    "FROM sidekick_schedule_runs ORDER BY claimed_at DESC LIMIT %s", (limit,)
+                )
+                return [
+                    {"task": task, "marker": marker, "owner": owner, "claimed_at": claimed_at.isoformat(),
+                     "finished_at": finished_at.isoformat() if finished_at else None, "status": status, "error": error}
+                    for task, marker, owner, claimed_at, finished_at, status, error in cursor.fetchall()
+                ]
+
+
+# ==========================
+#  🚧 DATABASE GATE
+# ==========================
+class DatabaseGate:
+    """
+    Keeps database users on the update workers from waiting on a dead database.
+
+    A webhook worker that blocks on a checkout or connect timeout stalls
+    every update queued behind it, so the corpus reads, update claims and
+    outbox inserts on that path ask the gate first and use their
+    fallback while it is closed.
+
+    available() is False while `healthy()` says so and for `backoff` seconds
+    after the caller reports a failed query with failed(). Refusals are
+    counted in `bypassed`.
+    """
+
+    def __init__(self, healthy=None, backoff=30.0):
+        self.healthy = healthy
+        self.backoff = backoff
+        self.bypassed = 0
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        if time.monotonic() >= self._unavailable_until and (not self.healthy or self.healthy()):
+            return True
+        with self._lock:
+            self.bypassed += 1
+        return False
+
+    def failed(self):
+        self._unavailable_until = time.monotonic() + self.backoff
+
+
+# ==========================
+#  🔁 PROCESSED UPDATE LOG
+# ==========================
+class ProcessedUpdateLog:
+    """
+    Durable record of handled Telegram update_ids, shared by all replicas.
+
+    claim() inserts the id and reports whether this process is the first to
+    see it. Rows older than `retention_hours` are pruned every
+    `prune_every` claims.
+
+    While its DatabaseGate is closed, claim() lets the update through (the
+    in-memory deduplicator still catches Telegram's own retries).
+    """
+
+    def __init__(self, pool, retention_hours=48, prune_every=500, healthy=None, backoff=30.0):
+        self.pool = pool
+        self.retention_hours = retention_hours
+        self.prune_every = prune_every
+        self.gate = DatabaseGate(healthy, backoff)
+        self._claims = 0
+        self._lock = threading.Lock()
+
+    def ensure_table(self, cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sidekick_processed_updates "
+            "(update_id BIGINT PRIMARY KEY, seen_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+
+    def claim(self, update_id):
+        # Fail open throughout: without the database we would rather risk a duplicate than drop an update.
+        if not self.pool.configured:
+            return True
+        if not self.gate.available():
+            return True
+        with self._lock:
+            self._claims += 1
+            prune = self._claims % self.prune_every == 0
+        try:
+            with self.pool.connection() as conn:
+                if not conn:
+                    raise RuntimeError("no database connection available")
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "INSERT INTO sidekick_processed_updates (update_id) VALUES (%s) "
+                        "ON CONFLICT (update_id) DO NOTHING RETURNING update_id",
+                        (update_id,)
+                    )
+                    claimed = cursor.fetchone() is not None
+                    if prune:
+                        cursor.execute(
+                            "DELETE FROM sidekick_processed_updates WHERE seen_at < now() - %s * interval '1 hour'",
+                            (self.retention_hours,)
+                        )
+                conn.commit()
+                return claimed
+        except Exception as e:
+            self.gate.failed()
+            logger.error(f"Failed to record Sidekick update {update_id}, skipping the persistent check for {self.gate.backoff:.0f}s: {e}")
+            return True
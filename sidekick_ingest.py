@@ -0,0 +1,236 @@
+# sidekick_ingest.py
+import json
+import logging
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+from sidekick_metrics import REGISTRY
+
+UPDATES_FILTERED = REGISTRY.counter(
+    "sidekick_updates_filtered_total", "Webhook updates dropped before deserialization.", labels=("reason",))
+
+logger = logging.getLogger(__name__)
+
+ADMIT_REJECT = "reject"          # Answer 503 so Telegram redelivers later
+ADMIT_DROP_NEWEST = "drop_newest"  # Ack and discard the incoming update
+ADMIT_DROP_OLDEST = "drop_oldest"  # Ack, discard the oldest queued update
+
+_UPDATE_ID_RE = re.compile(rb'"update_id"\s*:\s*(\d+)')
+
+
+def extract_update_id(payload):
+    """Reads `update_id` from the raw webhook body without deserializing it."""
+    match = _UPDATE_ID_RE.search(payload)
+    return int(match.group(1)) if match else None
+
+
+# ==========================
+#  🚦 UPDATE PRE-FILTER
+# ==========================
+class UpdatePreFilter:
+    """
+    Drops updates no handler cares about before telebot builds any objects.
+
+    The raw body is parsed with orjson when installed (plain json otherwise)
+    and only plain `message` updates with text or new members are kept,
+    optionally restricted to `allowed_chat_ids` (messages from `admin_ids`
+    always pass). The parsed dict is returned so it can be handed to telebot
+    without decoding the body a second time.
+    """
+
+    HANDLED_CONTENT_KEYS = ("text", "new_chat_members")
+
+    def __init__(self, allowed_chat_ids=None, admin_ids=()):
+        self._lock = threading.Lock()
+        self.filtered = {}
+        self.configure(allowed_chat_ids, admin_ids)
+
+    def configure(self, allowed_chat_ids=None, admin_ids=()):
+        # Swapped as one tuple so inspect() never sees half of an update.
+        self._rules = (frozenset(allowed_chat_ids) if allowed_chat_ids else None, frozenset(admin_ids))
+
+    def _drop(self, reason):
+        UPDATES_FILTERED.labels(reason=reason).inc()
+        with self._lock:
+            self.filtered[reason] = self.filtered.get(reason, 0) + 1
+        return None
+
+    def inspect(self, payload):
+        """Returns the parsed update if a handler may want it, otherwise None."""
+        try:
+            update = _json_loads(payload)
+        except ValueError:
+            return self._drop("invalid_json")
+        message = update.get("message") if isinstance(update, dict) else None
+        if not isinstance(message, dict):
+            return self._drop("update_type")
+        if not any(key in message for key in self.HANDLED_CONTENT_KEYS):
+            return self._drop("content_type")
+        chat, sender = message.get("chat"), message.get("from", {})
+        if not isinstance(chat, dict) or not isinstance(sender, dict):
+            return self._drop("invalid")
+        allowed_chat_ids, admin_ids = self._rules
+        if (allowed_chat_ids is not None and chat.get("id") not in allowed_chat_ids
+                and sender.get("id") not in admin_ids):
+            return self._drop("chat")
+        return update
+
+
+# ==========================
+#  🔁 UPDATE DEDUPLICATION
+# ==========================
+class UpdateDeduplicator:
+    """
+    Remembers the last `capacity` update_ids for at most `ttl` seconds.
+
+    A ring buffer keeps insertion order for eviction and a dict gives O(1)
+    lookups, so memory stays bounded no matter how many updates arrive.
+    """
+
+    def __init__(self, capacity=5000, ttl=3600.0):
+        self.capacity = max(1, capacity)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._order = deque()
+        self._seen = {}
+        self.duplicates = 0
+
+    def _evict_locked(self, now):
+        while self._order and (len(self._order) >= self.capacity or now - self._seen[self._order[0]] > self.ttl):
+            del self._seen[self._order.popleft()]
+
+    def is_duplicate(self, update_id):
+        """Records `update_id` and reports whether it was already seen."""
+        if update_id is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            if update_id in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[update_id] = now
+            self._order.append(update_id)
+            return False
+
+    def forget(self, update_id):
+        # Lets a refused update through again when Telegram redelivers it.
+        with self._lock:
+            self._seen.pop(update_id, None)
+            try:
+                self._order.remove(update_id)
+            except ValueError:
+                pass
+
+
+# ==========================
+#  📥 WEBHOOK UPDATE QUEUE
+# ==========================
+class UpdateQueue:
+    """
+    Bounded in-process queue between the webhook route and update handlers.
+
+    The route only calls offer() and returns immediately; a fixed pool of
+    worker threads runs `process_func` on each queued update. When the queue is
+    full the admission policy decides whether to push back on Telegram or to
+    shed load.
+    """
+
+    def __init__(self, process_func, workers=2, max_size=500, policy=ADMIT_REJECT, name="sidekick-ingest"):
+        self.process_func = process_func
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.policy = policy
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.stats = {
+            "accepted": 0, "rejected": 0, "dropped": 0, "processed": 0, "failed": 0,
+            "max_depth": 0, "last_lag_seconds": 0.0, "avg_lag_seconds": 0.0,
+        }
+
+    # --- Admission ---
+    def offer(self, payload):
+        """Returns False only when the update was refused and should be retried by the sender."""
+        item = (time.monotonic(), payload)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.policy == ADMIT_DROP_OLDEST:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    self._count("dropped")
+                    return True
+                self._count("dropped")
+            elif self.policy == ADMIT_DROP_NEWEST:
+                self._count("dropped")
+                return True
+            else:
+                self._count("rejected")
+                return False
+
+        depth = self._queue.qsize()
+        with self._lock:
+            self.stats["accepted"] += 1
+            if depth > self.stats["max_depth"]:
+                self.stats["max_depth"] = depth
+        return True
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+        logger.warning(f"Sidekick update queue full ({self.max_size}); update {key}.")
+
+    # --- Workers ---
+    def _worker_loop(self):
+        while True:
+            enqueued_at, payload = self._queue.get()
+            if payload is None:
+                return
+            lag = time.monotonic() - enqueued_at
+            try:
+                self.process_func(payload)
+                outcome = "processed"
+            except Exception as e:
+                outcome = "failed"
+                logger.error(f"Exception while processing Sidekick update: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                self.stats[outcome] += 1
+                self.stats["last_lag_seconds"] = lag
+                # Exponentially weighted average keeps the stat O(1).
+                self.stats["avg_lag_seconds"] += 0.1 * (lag - self.stats["avg_lag_seconds"])
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put((time.monotonic(), None))
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, depth=self._queue.qsize(), max_size=self.max_size, workers=self.workers)
@@ -0,0 +1,153 @@
+# sidekick_logging.py
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+# ==========================
+#  🎚️ SAMPLING & RATE LIMITS
+# ==========================
+def event_key(record):
+    """Event type of a record: an explicit `extra={"event": ...}`, otherwise its call site."""
+    return getattr(record, "event", None) or f"{record.name}:{record.funcName}:{record.lineno}"
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out high-volume INFO/DEBUG lines; warnings and errors always pass.
+
+    `sample_rates` maps an event key to the fraction of its records kept.
+    Independently, each event key may emit at most `per_minute` records per
+    minute; the next record that gets through reports how many were held
+    back in the meantime.
+    """
+
+    def __init__(self, sample_rates=None, per_minute=0):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.per_minute = per_minute
+        self._windows = {}  # event key -> [window_start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = event_key(record)
+        rate = self.sample_rates.get(key)
+        if rate is not None and random.random() >= rate:
+            return False
+        if not self.per_minute:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 60.0:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.per_minute:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+# ==========================
+#  📝 FORMATTERS
+# ==========================
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} similar lines suppressed)" if suppressed else line
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One compact JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# ==========================
+#  📬 QUEUE-BACKED PIPELINE
+# ==========================
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread instead of writing them.
+
+    When the queue is full, INFO/DEBUG records are dropped and counted, while
+    warnings and errors wait for room so they are never lost.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format the message once here, but keep exc_info for the listener's formatter.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+def setup_logging(level="INFO", json_lines=False, queue_size=10000, sample_rates=None, per_minute=0, stream=None):
+    """Replaces the root handlers with the queue pipeline; returns the running listener."""
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonLinesFormatter() if json_lines else TextFormatter(LOG_FORMAT))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sample_rates, per_minute))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener):
+    # Flushes whatever is still queued on shutdown; stop() fails if it was already stopped.
+    if listener._thread is not None:
+        listener.stop()
@@ -2,10 +2,10 @@
 import os
 import logging
 import random
-import time
 import re
-from datetime import datetime, timezone
 import threading
+import time
+from datetime import datetime, timezone
 
 # --- Third-Party Libraries ---
 try:
@@ -15,49 +15,155 @@ except ImportError:
     psycopg2 = None
     logging.critical("DIAGNOSTIK: CRITICAL - FAILED to import 'psycopg2'.")
 
-try:
-    import groq
-    import httpx
-    logging.info("DIAGNOSTIK: Libraries 'groq' and 'httpx' imported SUCCESSFULLY.")
-except ImportError:
-    groq = None
-    httpx = None
-    logging.warning("DIAGNOSTIK: 'groq' or 'httpx' not found. AI features will be disabled.")
-
 import telebot
-from config_sidekick import Config
+from config_sidekick import Config, ConfigError
+from sidekick_db import DatabasePool, ProcessedUpdateLog, ScheduleLogStore
+from sidekick_scheduler import ScheduledTask, Scheduler
+from sidekick_tasks import Coalescer, DelayedExecutor
+from sidekick_triggers import TriggerMatcher
+from sidekick_corpus import ResponseCorpus
+from sidekick_ai import LiveResponder, RenewalRunner, merge_lines
+from sidekick_metrics import timed_handler
+from sidekick_broadcast import BroadcastEngine, build_post_schedule, load_groups
+from sidekick_outbound import OutboundSender, PRIORITY_GREETING, PRIORITY_OWNER, PRIORITY_REPLY
+from sidekick_outbox import KIND_TEXT, Outbox
+from sidekick_probes import DependencyProbes, Probe, ProbeSkipped
+from sidekick_cooldowns import Cooldowns
 
-# ==========================
-#  🔧 LOGGING CONFIGURATION
-# ==========================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+# Phrases that mark a user asking who the Sidekick is (matched case-insensitively)
+IDENTITY_KEYWORDS = ["what are you", "what is this bot", "are you a bot", "who are you"]
+# Main bot welcome messages that should not get banter
+MAIN_BOT_WELCOME_MARKERS = ["Welcome to the NPEPEVERSE", "A wild", "new fren has appeared"]
+
+# Response categories that feed the trigger matcher
+TRIGGER_CATEGORIES = ("BANTER_REACTIONS",)
+
 # ==========================
 #  🤖 BOT LOGIC CLASS
 # ==========================
 class SidekickLogic:
     def __init__(self, bot_instance: telebot.TeleBot):
         self.bot = bot_instance
-        if not Config.DATABASE_URL() or not psycopg2:
+        settings = Config.current()
+        if not settings.DATABASE_URL or not psycopg2:
             logger.critical("FATAL: Sidekick's DATABASE_URL not found or psycopg2 is unavailable.")
         
-        self.groq_client = self._initialize_groq()
-        self.responses = self._load_all_responses()
-        self._ensure_db_table_exists()
+        self.db_pool = DatabasePool(
+            settings.DATABASE_URL,
+            min_size=settings.DB_POOL_MIN_SIZE,
+            max_size=settings.DB_POOL_MAX_SIZE,
+            max_idle=settings.DB_POOL_MAX_IDLE_SECONDS
+        )
+        self.schedule_store = ScheduleLogStore(
+            self.db_pool, ttl=settings.SCHEDULE_CACHE_TTL_SECONDS, lease=settings.SCHEDULE_LEASE_SECONDS
+        )
+        self._history = (None, None)  # Last good schedule_history() read, served while Postgres is down
+        self.update_log = (ProcessedUpdateLog(self.db_pool, healthy=self._database_healthy)
+                           if settings.DEDUP_PERSISTENT else None)
+        # groq and httpx are slow to import, so the client is only built when a renewal first needs it.
+        self._groq_client = None
+        self._groq_lock = threading.Lock()
+        self.ready = threading.Event()
+        # Built-in lists are only the fallback; the live corpus is versioned in Postgres.
+        self.responses = ResponseCorpus(
+            self.db_pool, self._load_all_responses,
+            refresh_interval=settings.CORPUS_REFRESH_SECONDS, on_change=self._on_responses_changed,
+            healthy=self._database_healthy
+        )
+        # Built-in triggers until bootstrap() has the schema and can read the live corpus.
+        self._rebuild_triggers(builtin=True)
+        self.outbound = OutboundSender(
+            self.bot,
+            global_rate=settings.OUTBOUND_GLOBAL_RATE,
+            chat_rate_per_minute=settings.OUTBOUND_CHAT_RATE_PER_MINUTE,
+            chat_burst=settings.OUTBOUND_CHAT_BURST,
+            workers=settings.OUTBOUND_WORKERS
+        )
+        # Delayed sends live in Postgres so a restart during the wait doesn't drop them.
+        self.outbox = Outbox(
+            self.db_pool, self.outbound,
+            renderers={"greeting": self._render_join_greeting}, coalesce_kinds=("greeting",),
+            owner=self.schedule_store.owner,
+            batch_size=settings.OUTBOX_BATCH_SIZE,
+            poll_interval=settings.OUTBOX_POLL_SECONDS,
+            lease=settings.OUTBOX_LEASE_SECONDS,
+            stale_after=settings.OUTBOX_STALE_SECONDS,
+            healthy=self._database_healthy
+        )
+        self.groups = load_groups(settings.GROUPS_FILE, settings.GROUP_CHAT_ID)
+        self.broadcaster = BroadcastEngine(self.outbound, self._pick_scheduled_message)
+        # The Sidekick's own bot user, needed to recognise mentions; fetched lazily and retried with backoff.
+        self.me = None
+        self._me_lock = threading.Lock()
+        self._me_retry_at = 0.0
+        self._me_backoff = 5.0
+        self.live_responder = LiveResponder(
+            lambda: self.groq_client, self._canned_identity_reply,
+            cache_size=settings.LIVE_REPLY_CACHE_SIZE,
+            cache_ttl=settings.LIVE_REPLY_CACHE_TTL_SECONDS,
+            budget_per_minute=settings.LIVE_REPLY_BUDGET_PER_MINUTE,
+            timeout=settings.LIVE_REPLY_TIMEOUT_SECONDS,
+            workers=settings.LIVE_REPLY_WORKERS
+        ) if settings.LIVE_REPLY_ENABLED else None
+        # Checked before any reply is scheduled, so spam costs neither a task nor an API call.
+        self.cooldowns = Cooldowns(settings.COOLDOWN_LIMITS, max_keys=settings.COOLDOWN_MAX_KEYS)
+        Config.subscribe(lambda new, old: self.cooldowns.configure(new.COOLDOWN_LIMITS))
+        self.executor = DelayedExecutor(
+            workers=settings.TASK_WORKERS,
+            max_pending=settings.TASK_MAX_PENDING,
+            overflow=settings.TASK_OVERFLOW_POLICY
+        )
+        self.join_coalescer = Coalescer(
+            self.executor, settings.GREETING_WINDOW_SECONDS, self._send_join_greeting, name="greet_new_members"
+        )
+        Config.subscribe(lambda new, old: setattr(self.join_coalescer, "window", new.GREETING_WINDOW_SECONDS))
+        # Scheduled posts and the AI renewal get their own workers: they never wait behind replies,
+        # a long renewal doesn't tie up a reply worker, and a claimed slot is never evicted.
+        self.schedule_executor = DelayedExecutor(workers=settings.SCHEDULE_WORKERS, name="sidekick-schedule")
+        self.scheduler = Scheduler(
+            self.schedule_store, self._build_schedule_table(),
+            jitter=settings.SCHEDULER_JITTER_SECONDS, clock=self._get_current_utc_time,
+            runner=self._run_scheduled_task
+        )
+        # Background checks feed the readiness route; health requests never touch a dependency themselves.
+        self.probes = DependencyProbes([
+            Probe("postgres", self._probe_database,
+                  interval=settings.PROBE_DB_INTERVAL_SECONDS, timeout=settings.PROBE_DB_TIMEOUT_SECONDS),
+            Probe("telegram", self.bot.get_me,
+                  interval=settings.PROBE_TELEGRAM_INTERVAL_SECONDS, timeout=settings.PROBE_TELEGRAM_TIMEOUT_SECONDS),
+            # Groq only powers optional features, so it is reported but never blocks readiness.
+            Probe("groq", self._probe_groq if settings.GROQ_API_KEY else None, required=False,
+                  interval=settings.PROBE_GROQ_INTERVAL_SECONDS, timeout=settings.PROBE_GROQ_TIMEOUT_SECONDS),
+        ])
         self._register_handlers()
         logger.info("✅ SidekickLogic initialized successfully with AI capabilities.")
 
+    @property
+    def groq_client(self):
+        if self._groq_client is None:
+            with self._groq_lock:
+                if self._groq_client is None:
+                    # False remembers a failed attempt so it isn't retried on every call.
+                    self._groq_client = self._initialize_groq() or False
+        return self._groq_client or None
+
     def _initialize_groq(self):
-        api_key = Config.GROQ_API_KEY()
-        if not api_key or not groq or not httpx:
-            logger.warning("Groq unavailable or GROQ_API_KEY is missing. AI features disabled.")
+        api_key = Config.current().GROQ_API_KEY
+        if not api_key:
+            logger.warning("GROQ_API_KEY is missing. AI features disabled.")
+            return None
+        try:
+            import groq
+            import httpx
+            logging.info("DIAGNOSTIK: Libraries 'groq' and 'httpx' imported SUCCESSFULLY.")
+        except ImportError:
+            logging.warning("DIAGNOSTIK: 'groq' or 'httpx' not found. AI features will be disabled.")
             return None
         try:
-            client = groq.Groq(api_key=api_key, http_client=httpx.Client(timeout=45.0))
+            # Retries are done by RenewalRunner/LiveResponder within their own deadlines, not by the SDK.
+            client = groq.Groq(api_key=api_key, http_client=httpx.Client(timeout=45.0), max_retries=0)
             logger.info("Groq client for Sidekick initialized successfully.")
             return client
         except Exception as e:
@@ -65,50 +171,66 @@ class SidekickLogic:
             return None
 
     # --- Database Methods ---
-    def _get_db_connection(self):
-        db_url = Config.DATABASE_URL()
-        if not db_url or not psycopg2: return None
-        try:
-            return psycopg2.connect(db_url)
-        except Exception as e:
-            logger.error(f"Sidekick DB connection failed: {e}")
-            return None
-
     def _ensure_db_table_exists(self):
-        conn = self._get_db_connection()
-        if conn:
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute("CREATE TABLE IF NOT EXISTS sidekick_schedule_log (task_name TEXT PRIMARY KEY, last_run_date TEXT)")
-                conn.commit()
-                logger.info("Database table 'sidekick_schedule_log' is ready.")
-            except Exception as e:
-                logger.error(f"Failed to create Sidekick schedule table: {e}")
-            finally:
-                conn.close()
+        with self.db_pool.connection() as conn:
+            if conn:
+                try:
+                    with conn.cursor() as cursor:
+                        self.schedule_store.ensure_table(cursor)
+                        self.responses.ensure_table(cursor)
+                        self.outbox.ensure_table(cursor)
+                        if self.update_log:
+                            self.update_log.ensure_table(cursor)
+                    conn.commit()
+                    logger.info("Sidekick database tables (schedule, responses, outbox, processed updates) are ready.")
+                except Exception as e:
+                    logger.error(f"Failed to create Sidekick database tables: {e}")
 
-    def _get_last_run_date(self, task_name):
-        conn = self._get_db_connection()
-        if not conn: return None
-        try:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT last_run_date FROM sidekick_schedule_log WHERE task_name = %s", (task_name,))
-                result = cursor.fetchone()
-            return result[0] if result else None
-        finally:
-            if conn: conn.close()
+    def _database_healthy(self):
+        # "unknown" (no probe answer yet) counts as healthy; the callers' own backoff covers that gap.
+        return self.probes.probes["postgres"].status not in ("failing", "timeout")
 
-    def _update_last_run_date(self, task_name, run_date):
-        conn = self._get_db_connection()
-        if not conn: return
-        try:
+    def _probe_database(self):
+        with self.db_pool.connection() as conn:
+            if not conn:
+                raise RuntimeError("no database connection available")
             with conn.cursor() as cursor:
-                cursor.execute("INSERT INTO sidekick_schedule_log (task_name, last_run_date) VALUES (%s, %s) ON CONFLICT (task_name) DO UPDATE SET last_run_date = EXCLUDED.last_run_date", (task_name, run_date))
-            conn.commit()
-        except Exception as e:
-            logger.error(f"Failed to update Sidekick DB for {task_name}: {e}")
-        finally:
-            if conn: conn.close()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            conn.rollback()
+
+    def _probe_groq(self):
+        # Reads _groq_client directly: going through groq_client would pull in groq/httpx during bootstrap.
+        if not Config.current().GROQ_API_KEY:
+            raise RuntimeError("GROQ_API_KEY is not set")
+        if self._groq_client is None:
+            raise ProbeSkipped("Groq client not initialized yet; it is built on first AI use")
+        if not self._groq_client:
+            raise RuntimeError("Groq client could not be initialized")
+        self._groq_client.models.list()
+
+    def readiness(self):
+        return {
+            "ready": self.ready.is_set() and self.probes.ready(),
+            "bootstrapped": self.ready.is_set(),
+            "dependencies": self.probes.snapshot(),
+        }
+
+    def schedule_history(self, limit=20):
+        """
+        Recent schedule runs for the status page as (runs, read_at, fresh).
+
+        The last successful read is kept and served instead of querying while
+        the postgres probe is failing or when the query itself fails; runs is
+        None if there has never been a good read.
+        """
+        if self._database_healthy():
+            try:
+                self._history = (self.schedule_store.history(limit), self._get_current_utc_time())
+                return self._history + (True,)
+            except Exception as e:
+                logger.error(f"Failed to read Sidekick schedule history, serving the last snapshot: {e}")
+        return self._history + (False,)
 
     def _get_current_utc_time(self):
         return datetime.now(timezone.utc)
@@ -375,67 +497,60 @@ class SidekickLogic:
             ]
         }
     
+    def _on_responses_changed(self, category):
+        if category in TRIGGER_CATEGORIES:
+            self._rebuild_triggers()
+
+    def _rebuild_triggers(self, builtin=False):
+        banter = self.responses.builtin("BANTER_REACTIONS") if builtin else self.responses.get("BANTER_REACTIONS", {})
+        triggers = [(("identity", kw), kw, False) for kw in IDENTITY_KEYWORDS]
+        triggers += [(("main_bot_welcome", marker), marker, True) for marker in MAIN_BOT_WELCOME_MARKERS]
+        triggers += [(("banter", trigger), trigger, True) for trigger in banter or {}]
+        # Swapped in as a whole, so handlers never see a half-built matcher.
+        self.triggers = TriggerMatcher(triggers)
+
     # --- Scheduler ---
+    def _build_schedule_table(self):
+        return build_post_schedule(self.groups, self.send_scheduled_message) + [
+            ScheduledTask('sk_ai_renewal', self.renew_responses_with_ai, hour=8, day_of_week=6)
+        ]
+
+    def _run_scheduled_task(self, task):
+        if not self.schedule_executor.submit(0, task.task, *task.args, name=task.name, evictable=False):
+            # Raising makes the scheduler record the claimed run as failed instead of leaving it 'running'.
+            raise RuntimeError(f"schedule executor refused {task.name}")
+
+    def start_services(self):
+        """Starts the sender and executor threads; they need no database, so this runs before the port binds."""
+        self.outbound.start()
+        self.executor.start()
+        self.schedule_executor.start()
+
+    def bootstrap(self):
+        """Database-dependent startup: schema, live triggers, then the scheduler."""
+        started = time.perf_counter()
+        self.probes.start()
+        self._ensure_db_table_exists()
+        schema_done = time.perf_counter()
+        self._bot_identity()
+        self._rebuild_triggers()
+        self.responses.start()
+        self.outbox.start()
+        self.scheduler.start()
+        self.ready.set()
+        logger.info(f"Sidekick bootstrap finished in {(time.perf_counter() - started) * 1000:.0f} ms "
+                    f"(schema {(schema_done - started) * 1000:.0f} ms).")
+
     def check_and_run_schedules(self):
-        now_utc = self._get_current_utc_time()
-        run_marker_hourly = now_utc.strftime('%Y-%m-%d-%H')
-        run_marker_weekly = now_utc.strftime('%Y-W%U')
-        
-        schedules = {
-            'sk_quote_10': {'hour': 10, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_QUOTES',)},
-            'sk_quote_20': {'hour': 20, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_QUOTES',)},
-            'sk_buy_00': {'hour': 0, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_buy_01': {'hour': 1, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_buy_03': {'hour': 3, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_buy_13': {'hour': 13, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_buy_15': {'hour': 15, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_buy_16': {'hour': 16, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_BUY',)},
-            'sk_pump_0030': {'hour': 0, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_0130': {'hour': 1, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_0300': {'hour': 3, 'minute': 0, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_0500': {'hour': 5, 'minute': 0, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_1330': {'hour': 13, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_1430': {'hour': 14, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_1530': {'hour': 15, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_pump_1630': {'hour': 16, 'minute': 30, 'task': self.send_scheduled_message, 'args': ('SCHEDULED_PUMP',)},
-            'sk_ai_renewal': {'hour': 8, 'day_of_week': 6, 'task': self.renew_responses_with_ai, 'is_weekly': True}
-        }
-        
-        for name, schedule in schedules.items():
-            is_weekly = schedule.get('is_weekly', False)
-            run_marker = run_marker_weekly if is_weekly else run_marker_hourly
-            last_run_marker = self._get_last_run_date(name)
-            
-            should_run = False
-            if is_weekly:
-                if (now_utc.weekday() == schedule['day_of_week'] and now_utc.hour >= schedule['hour'] and last_run_marker != run_marker):
-                    should_run = True
-            else:
-                target_hour = schedule['hour']
-                target_minute = schedule.get('minute', 0)
-                if (now_utc.hour == target_hour and now_utc.minute >= target_minute and last_run_marker != run_marker):
-                    should_run = True
+        # Runs any due slots right now; normally the scheduler thread does this on its own.
+        return self.scheduler.run_pending()
 
-            if should_run:
-                try:
-                    logger.info(f"Sidekick is running scheduled task: {name}")
-                    task_thread = threading.Thread(target=schedule['task'], args=schedule.get('args', ()))
-                    task_thread.start()
-                    self._update_last_run_date(name, run_marker)
-                except Exception as e:
-                    logger.error(f"Error running Sidekick scheduled task {name}: {e}", exc_info=True)
+    def send_scheduled_message(self, slot_name, response_key, groups):
+        self.broadcaster.broadcast(slot_name, response_key, groups)
 
-    def send_scheduled_message(self, response_key):
-        group_id = Config.GROUP_CHAT_ID()
-        if not group_id: return
+    def _pick_scheduled_message(self, response_key):
         message_list = self.responses.get(response_key, [])
-        if message_list:
-            message = random.choice(message_list)
-            try:
-                self.bot.send_message(group_id, message)
-                logger.info(f"Sidekick sent scheduled message ({response_key}) to {group_id}")
-            except Exception as e:
-                logger.error(f"Failed to send Sidekick scheduled message: {e}", exc_info=True)
+        return random.choice(message_list) if message_list else None
 
     # --- WEEKLY AI RENEWAL FEATURE ---
     def renew_responses_with_ai(self):
@@ -452,66 +567,164 @@ class SidekickLogic:
             "BOT_IDENTITY_SIDEKICK": ("Create 20 unique answers to the question 'who are you' for a sidekick bot. Position yourself as the 'aide' or 'hype man' of the main bot. Funny, energetic, and loyal. In English.", 15)
         }
         
+        settings = Config.current()
+        runner = RenewalRunner(
+            self.groq_client, self._accept_ai_line, lambda category: self.responses.get(category, []),
+            concurrency=settings.AI_RENEWAL_CONCURRENCY,
+            max_retries=settings.AI_RENEWAL_MAX_RETRIES,
+            deadline=settings.AI_RENEWAL_DEADLINE_SECONDS
+        )
+        logger.info(f"Sidekick AI is requesting updates for {len(categories_to_renew)} categories...")
+        results = runner.run(categories_to_renew)
+
         success_tracker = {}
+        renewed = {}
+        for category, result in results.items():
+            if result.status == "success":
+                # Merge into the current corpus instead of replacing it wholesale.
+                renewed[category] = merge_lines(result.lines, self.responses.get(category, []), settings.AI_CORPUS_MAX_ENTRIES)
+                status = f"✅ Success ({len(result.lines)} new entries)"
+            elif result.status == "too_few":
+                status = f"⚠️ Failed (Only {len(result.lines)}/{result.min_count} entries)"
+            elif result.status == "timeout":
+                status = "⏱️ Timed out"
+            else:
+                status = "❌ Error"
+            tokens = f"~{result.total_tokens} tokens (est.)" if result.tokens_estimated else f"{result.total_tokens} tokens"
+            success_tracker[category] = f"{status} · {result.latency:.1f}s · {tokens}"
 
-        for category, (prompt, min_count) in categories_to_renew.items():
-            try:
-                logger.info(f"Sidekick AI is requesting update for category: {category}...")
-                completion = self.groq_client.chat.completions.create(
-                    messages=[{"role": "system", "content": prompt}],
-                    model="llama3-8b-8192", temperature=1.0, max_tokens=3000
-                )
-                text = completion.choices[0].message.content
-                new_lines = [line.strip().lstrip('*-').strip() for line in re.split(r'\n|\d+\.', text) if line.strip() and len(line) > 5]
-                
-                if category == "GREET_NEW_MEMBERS_HYPE":
-                    new_lines = [line for line in new_lines if '{name}' in line]
-
-                if len(new_lines) >= min_count:
-                    self.responses[category] = new_lines
-                    success_tracker[category] = f"✅ Success ({len(new_lines)} new entries)"
-                else:
-                    success_tracker[category] = f"⚠️ Failed (Only {len(new_lines)}/{min_count} entries)"
-            except Exception as e:
-                success_tracker[category] = f"❌ Error"
-                logger.error(f"❌ Failed to update Sidekick category '{category}' with AI: {e}", exc_info=True)
+        # Publish every successful category in one go so replicas switch over together.
+        self.responses.publish(renewed)
 
         # --- SEND REPORT TO OWNER ---
-        owner_id = Config.GROUP_OWNER_ID()
+        total_tokens = sum(result.total_tokens for result in results.values())
+        tokens_estimated = any(result.tokens_estimated for result in results.values())
+        owner_id = settings.GROUP_OWNER_ID
         if owner_id:
             summary_report = ["*🤖 Sidekick Weekly AI Update Report* 🐸\n"]
             for category, status in success_tracker.items():
                 summary_report.append(f"*{category}:* {status}")
+            if tokens_estimated:
+                summary_report.append(f"\nTotal tokens: ~{total_tokens} (estimated; early-stopped calls report no usage)")
+            else:
+                summary_report.append(f"\nTotal tokens: {total_tokens}")
             
             final_report = "\n".join(summary_report)
             
-            try:
-                self.bot.send_message(owner_id, final_report, parse_mode="Markdown")
-                logger.info(f"AI renewal report sent successfully to Owner ID: {owner_id}")
-            except Exception as e:
-                logger.error(f"Failed to send AI renewal report to owner: {e}")
+            # Through the outbox, so a crash right after the renewal doesn't lose the report.
+            self._send_later(owner_id, final_report, 0, PRIORITY_OWNER, name="renewal_report", parse_mode="Markdown")
+            logger.info(f"AI renewal report queued for Owner ID: {owner_id}")
+
+    def _accept_ai_line(self, category, line):
+        if category == "GREET_NEW_MEMBERS_HYPE":
+            return '{name}' in line
+        return True
 
     # --- Message Handlers ---
     def _register_handlers(self):
-        self.bot.message_handler(content_types=['new_chat_members'])(self.greet_new_members_sidekick)
-        self.bot.message_handler(func=lambda message: True, content_types=['text'])(self.handle_all_messages)
+        self.bot.message_handler(commands=['reloadconfig'], func=self._is_owner)(self.handle_reload_config)
+        self.bot.message_handler(content_types=['new_chat_members'])(
+            timed_handler("greet_new_members_sidekick", self.greet_new_members_sidekick))
+        self.bot.message_handler(func=lambda message: True, content_types=['text'])(
+            timed_handler("handle_all_messages", self.handle_all_messages))
     
+    def _is_owner(self, message):
+        owner_id = Config.current().GROUP_OWNER_ID
+        return bool(owner_id and message.from_user and message.from_user.id == owner_id)
+
+    def handle_reload_config(self, message):
+        try:
+            changed = Config.reload()
+            reply = f"✅ Config reloaded. Changed: {', '.join(changed) or 'nothing'}"
+        except ConfigError as e:
+            logger.error(f"Config reload rejected, keeping the current settings: {e}")
+            reply = f"❌ Config reload rejected, keeping the current settings: {e}"
+        self.outbound.send(message.chat.id, reply, priority=PRIORITY_OWNER)
+
     def greet_new_members_sidekick(self, message):
-        def task():
-            try:
-                logger.info("New member detected by Sidekick, waiting 30 seconds...")
-                time.sleep(30)
-                for member in message.new_chat_members:
-                    first_name = (member.first_name or "fren").replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
-                    welcome_text = random.choice(self.responses.get("GREET_NEW_MEMBERS_HYPE", [])).format(name=f"[{first_name}](tg://user?id={member.id})")
-                    try:
-                        self.bot.send_message(message.chat.id, welcome_text, parse_mode="Markdown")
-                        logger.info(f"HYPE welcome from Sidekick sent to: {member.id}")
-                    except Exception as e:
-                        logger.error(f"Failed to send HYPE welcome: {e}")
-            except Exception as e:
-                logger.error(f"Error in greet_new_members_sidekick task: {e}", exc_info=True)
-        threading.Thread(target=task).start()
+        # Joins are batched per chat so a raid produces one greeting instead of one per member.
+        logger.info("New member(s) detected by Sidekick in %s, greeting after the join window...", message.chat.id,
+                    extra={"event": "join_detected"})
+        members = [(member.id, member.first_name) for member in message.new_chat_members]
+        if not self.outbox.enqueue("greeting", message.chat.id, {"members": members},
+                                   delay=Config.current().GREETING_WINDOW_SECONDS, priority=PRIORITY_GREETING):
+            self.join_coalescer.add(message.chat.id, members)
+
+    def _render_join_greeting(self, chat_id, payloads):
+        # Outbox renderer: every pending join row for the chat arrives here as one batch.
+        members = [tuple(member) for payload in payloads for member in payload["members"]]
+        limit = self.join_coalescer.max_items
+        return self._build_join_greeting(members[:limit], max(0, len(members) - limit)), {"parse_mode": "Markdown"}
+
+    def _build_join_greeting(self, members, extra_count):
+        max_mentions = Config.current().GREETING_MAX_MENTIONS
+        mentions = []
+        for member_id, first_name in members[:max_mentions]:
+            first_name = (first_name or "fren").replace('_', '\\_').replace('*', '\\*').replace('[', '\\[').replace('`', '\\`')
+            mentions.append(f"[{first_name}](tg://user?id={member_id})")
+        hidden_count = len(members) - len(mentions) + extra_count
+
+        names = mentions[0] if len(mentions) == 1 else ", ".join(mentions[:-1]) + " and " + mentions[-1]
+        welcome_text = random.choice(self.responses.get("GREET_NEW_MEMBERS_HYPE", [])).format(name=names)
+        if hidden_count:
+            welcome_text += f"\n\n...and {hidden_count} more legends just landed! 🚀"
+        if len(welcome_text) > 4000:
+            welcome_text = f"🚀 {len(members) + extra_count} new legends just joined the NPEPEVERSE! Welcome, all of you! 🔥"
+        return welcome_text
+
+    def _send_join_greeting(self, chat_id, members, extra_count):
+        # Coalescer fallback for when the outbox's database is unavailable.
+        try:
+            welcome_text = self._build_join_greeting(members, extra_count)
+            self.outbound.send(chat_id, welcome_text, priority=PRIORITY_GREETING, parse_mode="Markdown")
+            logger.info("HYPE welcome from Sidekick queued for %d member(s) in %s", len(members) + extra_count, chat_id,
+                        extra={"event": "greeting_queued"})
+        except Exception as e:
+            logger.error(f"Error in greet_new_members_sidekick task: {e}", exc_info=True)
+
+    def _send_later(self, chat_id, text, delay, priority, name, **kwargs):
+        """Durable delayed send via the outbox; falls back to an in-memory timer without a database."""
+        if self.outbox.enqueue(KIND_TEXT, chat_id, {"text": text, "kwargs": kwargs}, delay=delay, priority=priority):
+            return
+        self.executor.submit(delay, lambda: self.outbound.send(chat_id, text, priority=priority, **kwargs), name=name)
+
+    def _canned_identity_reply(self):
+        return random.choice(self.responses.get("BOT_IDENTITY_SIDEKICK", ["I'm the Hype Man!"]))
+
+    def _bot_identity(self):
+        """The Sidekick's bot user, or None while it can't be fetched (retried at most every 5 s .. 5 min)."""
+        if self.me is not None:
+            return self.me
+        if time.monotonic() < self._me_retry_at or not self._me_lock.acquire(blocking=False):
+            return None
+        try:
+            if self.me is None:
+                self.me = self.bot.get_me()
+                logger.info(f"Sidekick identified itself as @{self.me.username}.")
+        except Exception as e:
+            self._me_retry_at = time.monotonic() + self._me_backoff
+            logger.error(f"Could not fetch the Sidekick's own bot user, retrying in {self._me_backoff:.0f}s; "
+                         f"mentions won't get live replies until then: {e}")
+            self._me_backoff = min(self._me_backoff * 2, 300.0)
+        finally:
+            self._me_lock.release()
+        return self.me
+
+    def _is_addressed_to_me(self, message):
+        me = self._bot_identity()
+        if me is None:
+            return False
+        if message.chat.type == "private":
+            return True
+        reply = message.reply_to_message
+        if reply and reply.from_user and reply.from_user.id == me.id:
+            return True
+        return bool(me.username) and f"@{me.username.lower()}" in message.text.lower()
+
+    def _strip_mention(self, text):
+        if self.me and self.me.username:
+            text = re.sub(rf"@{re.escape(self.me.username)}\b", "", text, flags=re.IGNORECASE)
+        return text.strip()
 
     def handle_all_messages(self, message):
         if not message or not message.text: return
@@ -519,37 +732,51 @@ class SidekickLogic:
         sender_id = message.from_user.id
         chat_id = message.chat.id
         text = message.text
-        lower_text = text.lower().strip()
-        main_bot_id = Config.MAIN_BOT_USER_ID()
+        settings = Config.current()
+        matched = self.triggers.match(text)
+        matched_kinds = {kind for kind, _ in matched}
 
         # 1. Check if this is a message from the Main Bot to banter with
-        if main_bot_id and str(sender_id) == main_bot_id:
+        if settings.MAIN_BOT_USER_ID and sender_id == settings.MAIN_BOT_USER_ID:
             # Ignore the main bot's welcome message
-            if "Welcome to the NPEPEVERSE" in text or "A wild" in text or "new fren has appeared" in text:
+            if "main_bot_welcome" in matched_kinds:
                 return
             
             # If it's not a welcome message, start the banter
-            def banter_task():
-                logger.info("Message from Main Bot detected, waiting 30 seconds to reply...")
-                time.sleep(30)
-                for trigger, reply in self.responses.get("BANTER_REACTIONS", {}).items():
-                    if trigger in text:
-                        self.bot.send_message(chat_id, reply)
-                        logger.info(f"Banter sent in response to '{trigger}'")
-                        break
-            threading.Thread(target=banter_task).start()
+            banter_reactions = self.responses.get("BANTER_REACTIONS", {})
+            trigger = next((t for t in banter_reactions if ("banter", t) in matched), None)
+            if trigger is None:
+                return
+            if not self.cooldowns.allow("banter", chat_id):
+                logger.info("Banter in %s skipped, cooldown active", chat_id, extra={"event": "banter_cooldown"})
+                return
+            reply = banter_reactions[trigger]
+            banter_delay = settings.BANTER_DELAY_SECONDS
+            logger.info("Message from Main Bot detected, replying in %.0f seconds to '%s'...", banter_delay, trigger,
+                        extra={"event": "banter_detected"})
+            self._send_later(chat_id, reply, banter_delay, PRIORITY_REPLY, name="banter")
             return # Important: exit after handling banter
         
-        # 2. If not from Main Bot, check if it's an identity question from a user
-        identity_keywords = ["what are you", "what is this bot", "are you a bot", "who are you"]
-        if any(kw in lower_text for kw in identity_keywords):
-            def identity_task():
-                logger.info("Identity question for Sidekick detected, waiting 5 seconds...")
-                time.sleep(5)
-                reply = random.choice(self.responses.get("BOT_IDENTITY_SIDEKICK", ["I'm the Hype Man!"]))
-                try:
-                    self.bot.send_message(chat_id, reply)
-                except Exception as e:
-                    logger.error(f"Failed to send identity reply: {e}")
-            threading.Thread(target=identity_task).start()
+        # 2. Mentions of the Sidekick and replies to it get a live AI answer
+        if self.live_responder and self._is_addressed_to_me(message):
+            if not self.cooldowns.allow("live_reply", chat_id, sender_id):
+                logger.info("Live reply for %s in %s skipped, cooldown active", sender_id, chat_id,
+                            extra={"event": "live_reply_cooldown"})
+                return
+            def send_live_reply(reply, source):
+                self.outbound.send(chat_id, reply, priority=PRIORITY_REPLY, reply_to_message_id=message.message_id)
+                logger.info("Live reply (%s) queued for %s", source, chat_id, extra={"event": "live_reply_queued"})
+            self.live_responder.reply(self._strip_mention(text), send_live_reply)
+            return
+
+        # 3. Otherwise, check if it's an identity question from a user
+        if "identity" in matched_kinds:
+            if not self.cooldowns.allow("identity", chat_id, sender_id):
+                logger.info("Identity reply for %s in %s skipped, cooldown active", sender_id, chat_id,
+                            extra={"event": "identity_cooldown"})
+                return
+            identity_delay = settings.IDENTITY_DELAY_SECONDS
+            logger.info("Identity question for Sidekick detected, replying in %.0f seconds...", identity_delay,
+                        extra={"event": "identity_detected"})
+            self._send_later(chat_id, self._canned_identity_reply(), identity_delay, PRIORITY_REPLY, name="identity")
             return # Exit after handling identity question
@@ -1,60 +1,252 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # Diukur sebelum impor lain agar waktu impor ikut tercatat
+
 import os
+import hmac
 import logging
-import time
-from flask import Flask, request, abort
+import signal
+import threading
+from flask import Flask, Response, request, abort, jsonify
 import telebot
 from sidekick_logic import SidekickLogic
-from config_sidekick import Config  # Impor dari file config baru
+from config_sidekick import Config, ConfigError, build_settings  # Impor dari file config baru
+from sidekick_ingest import UpdateDeduplicator, UpdatePreFilter, UpdateQueue, extract_update_id
+from sidekick_metrics import REGISTRY, WEBHOOK_SECONDS, StartupTimer
+from sidekick_logging import setup_logging
+from sidekick_profiling import AllocationTracker, SamplingProfiler, thread_dump
 from waitress import serve
+from waitress.server import create_server
 
 # ==========================
 #  🔧 KONFIGURASI & INISIALISASI
 # ==========================
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+try:
+    settings, config_error = Config.current(), None
+except ConfigError as e:
+    # Nilai bawaan hanya untuk menjalankan server terdegradasi; bot tidak diinisialisasi.
+    settings, config_error = build_settings({}), e
+# Handler log hanya memasukkan record ke antrean; thread listener yang menulis ke stdout.
+setup_logging(
+    level=settings.LOG_LEVEL,
+    json_lines=settings.LOG_JSON,
+    queue_size=settings.LOG_QUEUE_SIZE,
+    sample_rates=dict(settings.LOG_SAMPLE_RATES),
+    per_minute=settings.LOG_RATE_LIMIT_PER_MINUTE
 )
 logger = logging.getLogger(__name__)
+startup = StartupTimer(STARTUP_STARTED)
+startup.mark("imports")
 
 app = Flask(__name__)
 bot = None
 sidekick_logic = None
+update_queue = None
+update_dedup = UpdateDeduplicator(settings.DEDUP_WINDOW_SIZE, settings.DEDUP_TTL_SECONDS)
+profiler = SamplingProfiler()
+allocations = AllocationTracker()
+update_filter = UpdatePreFilter(settings.ALLOWED_CHAT_IDS, [settings.GROUP_OWNER_ID] if settings.GROUP_OWNER_ID else ())
+
+# Filter update mengikuti konfigurasi terbaru setelah reload
+Config.subscribe(lambda new, old: update_filter.configure(
+    new.ALLOWED_CHAT_IDS, [new.GROUP_OWNER_ID] if new.GROUP_OWNER_ID else ()))
+
+def reload_config():
+    try:
+        Config.reload()
+    except ConfigError as e:
+        logger.error(f"Reload konfigurasi ditolak, konfigurasi lama tetap dipakai: {e}")
+
+def process_update(update_dict):
+    update_log = sidekick_logic.update_log
+    if update_log:
+        update_id = update_dict.get("update_id")
+        if update_id is not None and not update_log.claim(update_id):
+            logger.info("Update %s sudah diproses replika lain, dilewati.", update_id, extra={"event": "update_claimed_elsewhere"})
+            return
+    # telebot menerima dict yang sudah di-parse, jadi body tidak di-decode dua kali.
+    update = telebot.types.Update.de_json(update_dict)
+    bot.process_new_updates([update])
 
 # ==========================
 #  🚀 INISIALISASI BOT
 # ==========================
 try:
-    if all([Config.SIDEKICK_BOT_TOKEN(), Config.WEBHOOK_BASE_URL(), Config.DATABASE_URL()]):
-        bot = telebot.TeleBot(Config.SIDEKICK_BOT_TOKEN(), threaded=False)
+    if config_error is not None:
+        logger.critical(f"FATAL: Konfigurasi Sidekick tidak valid: {config_error}")
+    elif all([settings.SIDEKICK_BOT_TOKEN, settings.WEBHOOK_BASE_URL, settings.DATABASE_URL]):
+        bot = telebot.TeleBot(settings.SIDEKICK_BOT_TOKEN, threaded=False)
         sidekick_logic = SidekickLogic(bot)
+        update_queue = UpdateQueue(
+            process_update,
+            workers=settings.WEBHOOK_WORKERS,
+            max_size=settings.WEBHOOK_QUEUE_SIZE,
+            policy=settings.WEBHOOK_ADMISSION_POLICY
+        )
+        REGISTRY.gauge("sidekick_update_queue_depth", "Updates waiting for a worker.",
+                       func=lambda: update_queue.snapshot()["depth"])
+        REGISTRY.gauge("sidekick_update_lag_seconds", "Average time updates wait in the queue.",
+                       func=lambda: update_queue.snapshot()["avg_lag_seconds"])
+        REGISTRY.gauge("sidekick_outbound_pending", "Outgoing messages waiting to be sent.",
+                       func=lambda: sidekick_logic.outbound.snapshot()["pending"])
+        REGISTRY.gauge("sidekick_delayed_tasks_pending", "Delayed tasks waiting to run.",
+                       func=sidekick_logic.executor.pending_count)
     else:
         logger.critical("FATAL: Variabel lingkungan penting untuk Sidekick tidak ditemukan.")
 except Exception as e:
     logger.critical(f"Terjadi error saat inisialisasi Sidekick Bot: {e}", exc_info=True)
+startup.mark("init")
+
+def ensure_webhook(webhook_url):
+    # Cek dulu webhook yang terpasang; daftar ulang hanya jika URL-nya berbeda.
+    try:
+        if bot.get_webhook_info().url == webhook_url:
+            logger.info("✅ Webhook Sidekick sudah terpasang, tidak perlu didaftarkan ulang.")
+        elif bot.set_webhook(url=webhook_url):
+            logger.info("✅ Webhook Sidekick berhasil diatur.")
+        else:
+            logger.error("❌ Gagal mengatur webhook Sidekick.")
+    except Exception as e:
+        logger.error(f"Error saat mengkonfigurasi webhook Sidekick: {e}", exc_info=True)
+
+def finish_startup(webhook_url):
+    # Berjalan setelah server mendengarkan: webhook, skema DB, lalu penjadwal.
+    ensure_webhook(webhook_url)
+    startup.mark("webhook")
+    sidekick_logic.bootstrap()
+    startup.mark("bootstrap")
 
 # ==========================
 #  🌐 RUTE WEB FLASK
 # ==========================
-@app.route(f'/{Config.SIDEKICK_BOT_TOKEN()}', methods=['POST'])
+@app.route(f'/{settings.SIDEKICK_BOT_TOKEN}', methods=['POST'])
 def webhook():
+    with WEBHOOK_SECONDS.time():
+        return _handle_webhook()
+
+def _handle_webhook():
     if sidekick_logic and request.headers.get('content-type') == 'application/json':
-        try:
-            json_string = request.get_data().decode('utf-8')
-            update = telebot.types.Update.de_json(json_string)
-            bot.process_new_updates([update])
-        except Exception as e:
-            logger.error(f"Pengecualian di webhook Sidekick: {e}", exc_info=True)
+        # Update hanya dimasukkan ke antrean; worker yang memprosesnya, jadi Telegram langsung dapat 200.
+        payload = request.get_data()
+        update_id = extract_update_id(payload)
+        if update_dedup.is_duplicate(update_id):
+            return "OK", 200  # Pengiriman ulang dari Telegram, sudah diterima sebelumnya
+        update_dict = update_filter.inspect(payload)
+        if update_dict is None:
+            return "OK", 200  # Jenis update yang tidak ditangani handler mana pun
+        if not update_queue.offer(update_dict):
+            update_dedup.forget(update_id)
+            return "Busy", 503
         return "OK", 200
     else:
         abort(403)
 
 @app.route('/health/sidekick', methods=['GET'])
 def health_check():
-    logger.info("Ping 'Health Check' Sidekick diterima.")
-    if sidekick_logic:
-        sidekick_logic.check_and_run_schedules()
+    # Liveness untuk health check Render: tanpa I/O, hanya memeriksa thread penjadwal masih hidup.
+    # Selama bootstrap latar belum selesai penjadwal memang belum jalan, jadi jangan dianggap gagal.
+    # Kondisi Postgres/Telegram/Groq sengaja tidak dicek di sini (lihat /health/sidekick/ready),
+    # agar dependensi yang lambat tidak membuat Render me-restart bot yang sehat.
+    if sidekick_logic and sidekick_logic.ready.is_set() and not sidekick_logic.scheduler.is_alive():
+        logger.error("Penjadwal Sidekick tidak berjalan.")
+        return "scheduler stopped", 503
     return "", 204  # 204 No Content adalah respons yang efisien
 
+@app.route('/health/sidekick/ready', methods=['GET'])
+def readiness_check():
+    # Hanya membaca hasil probe latar yang tersimpan; tidak pernah menghubungi dependensi secara langsung.
+    if not sidekick_logic:
+        return jsonify({"ready": False}), 503
+    readiness = sidekick_logic.readiness()
+    return jsonify(readiness), 200 if readiness["ready"] else 503
+
+@app.route('/health/sidekick/scheduler', methods=['GET'])
+def scheduler_status():
+    if not sidekick_logic:
+        return jsonify({"running": False}), 503
+    return jsonify(sidekick_logic.scheduler.status()), 200
+
+@app.route('/health/sidekick/scheduler/runs', methods=['GET'])
+def scheduler_runs():
+    if not sidekick_logic:
+        return jsonify({"runs": []}), 503
+    # Saat Postgres bermasalah yang dikirim adalah snapshot terakhir (fresh=false), bukan query baru.
+    runs, read_at, fresh = sidekick_logic.schedule_history()
+    body = {"owner": sidekick_logic.schedule_store.owner, "runs": runs or [], "fresh": fresh,
+            "read_at": read_at.isoformat() if read_at else None}
+    if runs is None:
+        return jsonify(dict(body, error="riwayat jadwal tidak tersedia, database tidak dapat dihubungi")), 503
+    return jsonify(body), 200
+
+@app.route('/health/sidekick/ingest', methods=['GET'])
+def ingest_status():
+    if not update_queue:
+        return jsonify({"workers": 0}), 503
+    update_log = sidekick_logic.update_log if sidekick_logic else None
+    return jsonify(dict(update_queue.snapshot(), duplicates=update_dedup.duplicates,
+                        filtered=dict(update_filter.filtered),
+                        persistent_dedup_bypassed=update_log.gate.bypassed if update_log else 0)), 200
+
+@app.route('/health/sidekick/broadcasts', methods=['GET'])
+def broadcast_status():
+    if not sidekick_logic:
+        return jsonify({"broadcasts": []}), 503
+    return jsonify(sidekick_logic.broadcaster.snapshot()), 200
+
+@app.route('/health/sidekick/outbox', methods=['GET'])
+def outbox_status():
+    if not sidekick_logic:
+        return jsonify({"running": False}), 503
+    return jsonify(sidekick_logic.outbox.snapshot()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+# ==========================
+#  🛠️ RUTE ADMIN (PROFILING)
+# ==========================
+def require_admin():
+    # Hanya pemilik yang memegang SIDEKICK_ADMIN_TOKEN; tanpa token endpoint admin seolah tidak ada.
+    token = Config.current().ADMIN_TOKEN
+    given = request.headers.get("X-Sidekick-Admin-Token", "")
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(given.encode("utf-8"), token.encode("utf-8")):
+        abort(403)
+
+@app.route('/admin/sidekick/profile', methods=['POST'])
+def admin_profile():
+    require_admin()
+    # Request ini menunggu selama sesi sampling berjalan (maksimal 60 detik).
+    stats = profiler.profile(
+        request.args.get("seconds", 10.0, type=float),
+        interval=request.args.get("interval_ms", 5.0, type=float) / 1000,
+        limit=request.args.get("limit", 40, type=int)
+    )
+    if stats is None:
+        return jsonify({"error": "sesi profiling lain sedang berjalan"}), 409
+    return jsonify(stats), 200
+
+@app.route('/admin/sidekick/tracemalloc', methods=['GET', 'POST', 'DELETE'])
+def admin_tracemalloc():
+    require_admin()
+    if request.method == 'POST':
+        return jsonify(allocations.start(request.args.get("frames", 10, type=int))), 200
+    if request.method == 'DELETE':
+        return jsonify(allocations.stop()), 200
+    snapshot = allocations.snapshot(
+        limit=request.args.get("limit", 25, type=int),
+        group_by="filename" if request.args.get("group_by") == "filename" else "lineno"
+    )
+    if snapshot is None:
+        return jsonify({"tracing": False, "error": "tracemalloc belum dimulai (POST dulu)"}), 409
+    return jsonify(snapshot), 200
+
+@app.route('/admin/sidekick/threads', methods=['GET'])
+def admin_threads():
+    require_admin()
+    return jsonify(thread_dump()), 200
+
 @app.route('/sidekick')
 def index():
     return "🐸 Sidekick Bot NPEPE hidup - webhook diaktifkan.", 200
@@ -65,20 +257,20 @@ def index():
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10001))
     if bot and sidekick_logic:
-        webhook_url = f"{Config.WEBHOOK_BASE_URL()}/{Config.SIDEKICK_BOT_TOKEN()}"
-        logger.info("Memulai Sidekick Bot dan mengatur webhook...")
-        try:
-            bot.remove_webhook()
-            time.sleep(0.5)
-            success = bot.set_webhook(url=webhook_url)
-            if success:
-                logger.info("✅ Webhook Sidekick berhasil diatur.")
-            else:
-                logger.error("❌ Gagal mengatur webhook Sidekick.")
-        except Exception as e:
-            logger.error(f"Error saat mengkonfigurasi webhook Sidekick: {e}", exc_info=True)
-        
-        serve(app, host="0.0.0.0", port=port)
+        webhook_url = f"{settings.WEBHOOK_BASE_URL}/{settings.SIDEKICK_BOT_TOKEN}"
+        logger.info("Memulai Sidekick Bot...")
+        if hasattr(signal, "SIGHUP"):
+            # SIGHUP memuat ulang konfigurasi; dikerjakan di thread lain agar handler sinyal tetap ringan.
+            signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                target=reload_config, name="sidekick-config-reload", daemon=True).start())
+
+        sidekick_logic.start_services()
+        update_queue.start()
+        # Port langsung di-bind; webhook dan skema DB diurus di thread latar agar start dingin tetap cepat.
+        server = create_server(app, host="0.0.0.0", port=port)
+        startup.mark("bind")
+        threading.Thread(target=finish_startup, args=(webhook_url,), name="sidekick-startup", daemon=True).start()
+        server.run()
     else:
         logger.error("Sidekick Bot tidak diinisialisasi. Berjalan dalam mode server terdegradasi.")
         serve(app, host="0.0.0.0", port=port)
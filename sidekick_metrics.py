@@ -0,0 +1,226 @@
+# sidekick_metrics.py
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ==========================
+#  📈 LOCK-LIGHT PRIMITIVES
+# ==========================
+class _ShardedValues:
+    """
+    Fixed-size vector of floats with one private copy per thread.
+
+    Writers only touch their own thread's shard, so the hot path takes no
+    lock; the registry lock is taken once per thread (on first write) and
+    when a scrape sums the shards.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def shard(self):
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = [0.0] * self._size
+            with self._lock:
+                self._shards.append(values)
+            self._local.values = values
+        return values
+
+    def totals(self):
+        with self._lock:
+            shards = list(self._shards)
+        return [sum(column) for column in zip(*shards)] if shards else [0.0] * self._size
+
+
+class Counter:
+    def __init__(self):
+        self._values = _ShardedValues(1)
+
+    def inc(self, amount=1):
+        self._values.shard()[0] += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self._values.totals()[0]
+
+
+class Gauge:
+    def __init__(self, func=None):
+        self._value = 0.0
+        self._func = func
+
+    def set(self, value):
+        self._value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self._func() if self._func else self._value
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Layout: one slot per bucket, then the overflow (+Inf) slot, then the sum.
+        self._values = _ShardedValues(len(self.buckets) + 2)
+
+    def observe(self, value):
+        values = self._values.shard()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labels):
+        totals = self._values.totals()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), totals[:-1]):
+            cumulative += count
+            yield f"{name}_bucket", labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),), cumulative
+        yield f"{name}_sum", labels, totals[-1]
+        yield f"{name}_count", labels, cumulative
+
+
+# ==========================
+#  🏷️ METRIC FAMILIES
+# ==========================
+class MetricFamily:
+    def __init__(self, name, help_text, kind, labelnames, factory):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def __getattr__(self, attr):
+        # Unlabelled families forward inc/observe/set/time to their single child.
+        if attr.startswith("_") or self.labelnames:
+            raise AttributeError(attr)
+        return getattr(self._children[()], attr)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            for sample_name, labels, value in child.samples(self.name, tuple(zip(self.labelnames, key))):
+                label_text = ",".join(f'{name}="{_escape(value_)}"' for name, value_ in labels)
+                lines.append(f"{sample_name}{{{label_text}}} {_format(value)}" if label_text else f"{sample_name} {_format(value)}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families = []
+        self._lock = threading.Lock()
+
+    def _register(self, family):
+        with self._lock:
+            self._families.append(family)
+        return family
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(MetricFamily(name, help_text, "counter", labels, Counter))
+
+    def gauge(self, name, help_text, labels=(), func=None):
+        return self._register(MetricFamily(name, help_text, "gauge", labels, lambda: Gauge(func)))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(MetricFamily(name, help_text, "histogram", labels, lambda: Histogram(buckets)))
+
+    def render(self):
+        with self._lock:
+            families = list(self._families)
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+# ==========================
+#  📊 SIDEKICK METRICS
+# ==========================
+REGISTRY = MetricsRegistry()
+
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "sidekick_webhook_request_seconds", "Time spent in the webhook route before answering Telegram.")
+HANDLER_SECONDS = REGISTRY.histogram(
+    "sidekick_handler_seconds", "Update processing time per message handler.", labels=("handler",))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "sidekick_db_query_seconds", "Latency of database round trips.", labels=("query",))
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    "sidekick_telegram_send_seconds", "Latency of Telegram send_message calls.")
+TELEGRAM_SEND_ERRORS = REGISTRY.counter(
+    "sidekick_telegram_send_errors_total", "Failed Telegram send_message calls.", labels=("code",))
+GROQ_CALL_SECONDS = REGISTRY.histogram(
+    "sidekick_groq_call_seconds", "Latency of Groq completion calls.", labels=("category",),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0))
+GROQ_TOKENS = REGISTRY.counter(
+    "sidekick_groq_tokens_total", "Tokens used by Groq completion calls.", labels=("kind",))
+LIVE_REPLIES = REGISTRY.counter(
+    "sidekick_live_replies_total", "Mention replies by where the answer came from.", labels=("source",))
+SCHEDULER_LAG_SECONDS = REGISTRY.gauge(
+    "sidekick_scheduler_lag_seconds", "Delay between a schedule slot and the moment it ran.", labels=("task",))
+THREADS = REGISTRY.gauge(
+    "sidekick_threads", "Live Python threads.", func=threading.active_count)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "sidekick_startup_phase_seconds", "Time spent in each startup phase.", labels=("phase",))
+
+
+class StartupTimer:
+    """Logs how long each startup phase took, measured from the previous mark."""
+
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self._last = self.started
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        with self._lock:
+            now = time.perf_counter()
+            took, self._last = now - self._last, now
+        STARTUP_SECONDS.labels(phase=phase).set(took)
+        logger.info(f"Startup phase '{phase}' took {took * 1000:.0f} ms ({(now - self.started) * 1000:.0f} ms since start)")
+
+
+def timed_handler(name, func):
+    """Wraps a telebot handler so its run time lands in HANDLER_SECONDS."""
+    histogram = HANDLER_SECONDS.labels(handler=name)
+
+    def wrapper(message):
+        with histogram.time():
+            return func(message)
+    wrapper.__name__ = getattr(func, "__name__", name)
+    return wrapper
@@ -0,0 +1,238 @@
+# sidekick_outbound.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from sidekick_metrics import REGISTRY, TELEGRAM_SEND_ERRORS, TELEGRAM_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_TOTAL = REGISTRY.counter(
+    "sidekick_outbound_total", "Outgoing messages by outcome (queued, sent, throttled, retried, dropped, failed).",
+    labels=("outcome",))
+
+# Lower value is sent first.
+PRIORITY_OWNER = 0
+PRIORITY_REPLY = 1
+PRIORITY_GREETING = 2
+PRIORITY_HYPE = 3
+
+
+# ==========================
+#  🪣 TOKEN BUCKET
+# ==========================
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 when one can be taken now)."""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _OutboundMessage:
+    def __init__(self, seq, chat_id, text, priority, kwargs, on_done=None):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.attempts = 0
+        self.not_before = 0.0
+
+    def finish(self, status, error=None):
+        if self.on_done:
+            try:
+                self.on_done(self.chat_id, status, error)
+            except Exception as e:
+                logger.error(f"Sidekick outbound delivery callback failed for {self.chat_id}: {e}", exc_info=True)
+
+
+# ==========================
+#  📤 OUTBOUND SENDER
+# ==========================
+class OutboundSender:
+    """
+    Central, rate-limited path for every outgoing Telegram message.
+
+    send() only enqueues. A few sender threads pick the highest-priority
+    message whose chat has a free token, take a token from the global bucket
+    as well, and call bot.send_message. A 429 blocks that chat for the
+    `retry_after` Telegram asks for and the message is retried; other errors
+    are retried with backoff up to `max_attempts`. An optional `on_done`
+    callback learns how each message ended ("sent", "failed" or "dropped").
+    """
+
+    def __init__(self, bot, global_rate=25.0, chat_rate_per_minute=20.0, chat_burst=3,
+                 max_pending=2000, max_attempts=4, workers=3, name="sidekick-outbound"):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate_per_minute / 60.0
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.workers = max(1, workers)
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._ready = []    # (priority, seq, message)
+        self._delayed = []  # (not_before, seq, message)
+        self._chat_buckets = {}
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopped = False
+        self.stats = {"queued": 0, "sent": 0, "throttled": 0, "retried": 0, "dropped": 0, "failed": 0}
+
+    # --- Public API ---
+    def send(self, chat_id, text, priority=PRIORITY_REPLY, on_done=None, **kwargs):
+        """Queues a message for delivery; returns False if it was dropped."""
+        with self._cond:
+            if len(self._ready) + len(self._delayed) >= self.max_pending:
+                self._count("dropped")
+                logger.warning(f"Sidekick outbound queue full ({self.max_pending}); dropped message to {chat_id}.")
+                return False
+            message = _OutboundMessage(next(self._seq), chat_id, text, priority, kwargs, on_done)
+            heapq.heappush(self._ready, (priority, message.seq, message))
+            self._count("queued")
+            self._cond.notify()
+        return True
+
+    def _count(self, outcome):
+        # Called with the condition held; the counter mirrors stats for /metrics.
+        self.stats[outcome] += 1
+        OUTBOUND_TOTAL.labels(outcome=outcome).inc()
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, pending=len(self._ready) + len(self._delayed), chats=len(self._chat_buckets))
+
+    # --- Scheduling ---
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.is_idle(now)}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _defer_locked(self, message, not_before):
+        message.not_before = not_before
+        heapq.heappush(self._delayed, (not_before, message.seq, message))
+
+    def _next_message_locked(self):
+        """Blocks until a message may be sent now; returns None once stopped."""
+        while not self._stopped:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, message = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (message.priority, message.seq, message))
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            if self._ready:
+                _, _, message = heapq.heappop(self._ready)
+                chat_wait = self._chat_bucket(message.chat_id, now).wait_time(now)
+                if chat_wait > 0:
+                    # Park it so messages for other chats are not held up behind it.
+                    self._count("throttled")
+                    self._defer_locked(message, now + chat_wait)
+                    continue
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait <= 0:
+                    self.global_bucket.take(now)
+                    self._chat_buckets[message.chat_id].take(now)
+                    return message
+                self._count("throttled")
+                heapq.heappush(self._ready, (message.priority, message.seq, message))
+                timeout = global_wait if timeout is None else min(timeout, global_wait)
+            self._cond.wait(timeout)
+        return None
+
+    def _handle_failure(self, message, error):
+        now = time.monotonic()
+        retry_after = None
+        if getattr(error, "error_code", None) == 429:
+            result = getattr(error, "result_json", None) or {}
+            retry_after = float(result.get("parameters", {}).get("retry_after", 1))
+        elif getattr(error, "error_code", None) is not None:
+            # Any other Bot API error (bad markup, bot blocked, ...) will not succeed on retry.
+            with self._cond:
+                self._count("failed")
+            logger.error(f"Failed to send Sidekick message to {message.chat_id}: {error}")
+            message.finish("failed", error)
+            return
+
+        with self._cond:
+            if message.attempts >= self.max_attempts:
+                self._count("dropped")
+                delay = None
+            else:
+                delay = retry_after if retry_after is not None else min(30.0, 2 ** message.attempts)
+                if retry_after is not None:
+                    self._chat_bucket(message.chat_id, now).block(now, retry_after)
+                self._count("retried")
+                self._defer_locked(message, now + delay)
+                self._cond.notify()
+        if delay is None:
+            logger.error(f"Dropping Sidekick message to {message.chat_id} after {message.attempts} attempts: {error}")
+            message.finish("dropped", error)
+            return
+        logger.warning(f"Retrying Sidekick message to {message.chat_id} in {delay:.1f}s: {error}")
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                message = self._next_message_locked()
+            if message is None:
+                return
+            message.attempts += 1
+            started = time.perf_counter()
+            try:
+                self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+            except Exception as e:
+                TELEGRAM_SEND_ERRORS.labels(code=getattr(e, "error_code", None) or "network").inc()
+                self._handle_failure(message, e)
+                continue
+            finally:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started)
+            with self._cond:
+                self._count("sent")
+            message.finish("sent")
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
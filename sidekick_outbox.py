@@ -0,0 +1,277 @@
+# sidekick_outbox.py
+import logging
+import threading
+
+from sidekick_db import DatabaseGate, psycopg2
+from sidekick_metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+KIND_TEXT = "text"
+
+
+# ==========================
+#  📮 DURABLE OUTBOX
+# ==========================
+class Outbox:
+    """
+    Delayed sends kept in Postgres (`sidekick_outbox`) so restarts don't lose them.
+
+    enqueue() stores a row with its due time. A dispatcher thread claims due
+    rows in batches with `FOR UPDATE SKIP LOCKED` (so replicas never grab the
+    same row), renders them and hands them to the OutboundSender. The
+    delivery callback only queues the outcome; the dispatcher marks the rows
+    sent or failed on its next pass, so sender threads never wait on the
+    database. A claim is a lease:
+    rows whose claimant died are picked up again after `lease` seconds.
+    While a row waits in the OutboundSender (rate limits, 429 retries), or
+    its outcome waits to be written, every dispatcher pass renews its lease,
+    so it is never re-claimed and sent twice.
+    Rows due more than `stale_after` seconds ago are expired instead of sent,
+    which bounds what gets replayed after a long outage. A row the
+    OutboundSender refuses goes back to pending with a `retry_at`; its
+    `due_at` is kept, so a requeued row still ages out.
+
+    Rows of a `coalesce_kinds` kind are merged per chat: when one is due, all
+    pending rows of that kind for the chat are claimed with it and rendered
+    together. Renderers map a kind to `func(chat_id, payloads) -> (text, kwargs)`;
+    the built-in "text" kind sends `payload["text"]` as is.
+
+    The dispatcher polls, sleeping until the earliest known due time (at most
+    `poll_interval`) and waking early on local enqueues.
+
+    While its DatabaseGate is closed, enqueue() declines and the caller
+    falls back.
+    """
+
+    def __init__(self, pool, outbound, renderers=None, coalesce_kinds=(), owner="sidekick",
+                 batch_size=50, poll_interval=5.0, lease=120.0, stale_after=600.0, healthy=None, backoff=30.0):
+        self.pool = pool
+        self.outbound = outbound
+        self.renderers = dict(renderers or {})
+        self.coalesce_kinds = tuple(coalesce_kinds)
+        self.owner = owner
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.stale_after = stale_after
+        self.gate = DatabaseGate(healthy, backoff)
+
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._inflight = set()  # ids handed to the OutboundSender whose outcome isn't written yet
+        self._completed = []  # (ids, status, error) reported by the sender, written by the dispatcher
+        self.stats = {"enqueued": 0, "claimed": 0, "sent": 0, "failed": 0, "expired": 0, "requeued": 0}
+
+    def ensure_table(self, cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS sidekick_outbox "
+            "(id BIGSERIAL PRIMARY KEY, kind TEXT NOT NULL, chat_id BIGINT NOT NULL, payload JSONB NOT NULL, "
+            "priority SMALLINT NOT NULL DEFAULT 1, due_at TIMESTAMPTZ NOT NULL, status TEXT NOT NULL DEFAULT 'pending', "
+            "claimed_by TEXT, claimed_until TIMESTAMPTZ, created_at TIMESTAMPTZ NOT NULL DEFAULT now(), "
+            "finished_at TIMESTAMPTZ, error TEXT, retry_at TIMESTAMPTZ)"
+        )
+        cursor.execute("ALTER TABLE sidekick_outbox ADD COLUMN IF NOT EXISTS retry_at TIMESTAMPTZ")
+        cursor.execute("CREATE INDEX IF NOT EXISTS sidekick_outbox_due ON sidekick_outbox (due_at) "
+                       "WHERE status IN ('pending', 'sending')")
+        cursor.execute("DELETE FROM sidekick_outbox WHERE status IN ('sent', 'failed', 'expired') "
+                       "AND created_at < now() - interval '7 days'")
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    # --- Producing ---
+    def enqueue(self, kind, chat_id, payload, delay=0.0, priority=1):
+        """Stores a delayed send; returns False if the database is unavailable so the caller can fall back."""
+        if not self.pool or not psycopg2 or not self.pool.configured:
+            return False
+        if not self.gate.available():
+            return False
+        try:
+            with self.pool.connection() as conn:
+                if not conn:
+                    raise RuntimeError("no database connection available")
+                with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="outbox_enqueue").time():
+                    cursor.execute(
+                        "INSERT INTO sidekick_outbox (kind, chat_id, payload, priority, due_at) "
+                        "VALUES (%s, %s, %s, %s, now() + %s * interval '1 second')",
+                        (kind, chat_id, psycopg2.extras.Json(payload), priority, delay)
+                    )
+                conn.commit()
+        except Exception as e:
+            self.gate.failed()
+            logger.error(f"Failed to store Sidekick outbox entry for {chat_id}, bypassing the outbox for {self.gate.backoff:.0f}s: {e}")
+            return False
+        self._count("enqueued")
+        self._wakeup.set()
+        return True
+
+    # --- Dispatching ---
+    def _claim_batch(self):
+        """Renews in-flight leases, expires stale rows, claims due ones; returns (rows, seconds until the next pending row)."""
+        with self._lock:
+            inflight = list(self._inflight)
+        with self.pool.connection() as conn:
+            if not conn: return [], self.poll_interval
+            with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="outbox_claim").time():
+                if inflight:
+                    cursor.execute(
+                        "UPDATE sidekick_outbox SET claimed_until = now() + %s * interval '1 second' "
+                        "WHERE id = ANY(%s) AND status = 'sending' AND claimed_by = %s",
+                        (self.lease, inflight, self.owner)
+                    )
+                cursor.execute(
+                    "UPDATE sidekick_outbox SET status = 'expired', finished_at = now() "
+                    "WHERE due_at < now() - %s * interval '1 second' "
+                    "AND (status = 'pending' OR (status = 'sending' AND claimed_until < now()))",
+                    (self.stale_after,)
+                )
+                expired = cursor.rowcount
+                cursor.execute(
+                    "UPDATE sidekick_outbox SET status = 'sending', claimed_by = %s, "
+                    "claimed_until = now() + %s * interval '1 second' "
+                    "WHERE id IN (SELECT id FROM sidekick_outbox "
+                    "WHERE (status = 'pending' AND due_at <= now() AND (retry_at IS NULL OR retry_at <= now())) "
+                    "OR (status = 'sending' AND claimed_until < now()) "
+                    "ORDER BY due_at LIMIT %s FOR UPDATE SKIP LOCKED) "
+                    "RETURNING id, kind, chat_id, payload, priority",
+                    (self.owner, self.lease, self.batch_size)
+                )
+                rows = cursor.fetchall()
+                chats = list({chat_id for _, kind, chat_id, _, _ in rows if kind in self.coalesce_kinds})
+                if chats:
+                    # Pull the rest of each chat's open batch forward so it goes out as one message.
+                    cursor.execute(
+                        "UPDATE sidekick_outbox SET status = 'sending', claimed_by = %s, "
+                        "claimed_until = now() + %s * interval '1 second' "
+                        "WHERE id IN (SELECT id FROM sidekick_outbox WHERE status = 'pending' "
+                        "AND kind = ANY(%s) AND chat_id = ANY(%s) FOR UPDATE SKIP LOCKED) "
+                        "RETURNING id, kind, chat_id, payload, priority",
+                        (self.owner, self.lease, list(self.coalesce_kinds), chats)
+                    )
+                    rows += cursor.fetchall()
+                cursor.execute("SELECT EXTRACT(EPOCH FROM (min(GREATEST(due_at, retry_at)) - now())) "
+                               "FROM sidekick_outbox WHERE status = 'pending'")
+                next_due = cursor.fetchone()[0]
+            conn.commit()
+        with self._lock:
+            # A lease that lapsed anyway (e.g. the database was unreachable) comes back to us; it is still queued here.
+            rows = [row for row in rows if row[0] not in self._inflight]
+        if expired:
+            self._count("expired", expired)
+            logger.warning(f"Expired {expired} Sidekick outbox entries older than {self.stale_after:.0f}s.")
+        wait = self.poll_interval if next_due is None else min(self.poll_interval, max(0.0, float(next_due)))
+        return rows, wait
+
+    def _finish(self, ids, status, error=None):
+        """Writes the rows' outcome; returns False if the database couldn't be reached."""
+        try:
+            with self.pool.connection() as conn:
+                if not conn:
+                    raise RuntimeError("no database connection available")
+                with conn.cursor() as cursor, DB_QUERY_SECONDS.labels(query="outbox_finish").time():
+                    if status == "pending":
+                        cursor.execute(
+                            "UPDATE sidekick_outbox SET status = 'pending', claimed_by = NULL, claimed_until = NULL, "
+                            "retry_at = now() + interval '5 seconds' WHERE id = ANY(%s)", (ids,)
+                        )
+                    else:
+                        cursor.execute(
+                            "UPDATE sidekick_outbox SET status = %s, error = %s, finished_at = now() WHERE id = ANY(%s)",
+                            (status, str(error) if error is not None else None, ids)
+                        )
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to mark Sidekick outbox entries {ids} as {status}: {e}")
+            return False
+        return True
+
+    def _release(self, ids):
+        with self._lock:
+            self._inflight.difference_update(ids)
+
+    def _on_delivery(self, ids):
+        # Runs on an OutboundSender thread: the rows stay in flight (and leased) until the dispatcher writes this.
+        def done(chat_id, status, error=None):
+            final = "sent" if status == "sent" else "failed"
+            self._count(final, len(ids))
+            with self._lock:
+                self._completed.append((ids, final, error))
+        return done
+
+    def _write_completed(self):
+        """Writes queued delivery outcomes; on a database error the rest are kept for the next pass."""
+        with self._lock:
+            completed, self._completed = self._completed, []
+        for index, (ids, status, error) in enumerate(completed):
+            if not self._finish(ids, status, error):
+                with self._lock:
+                    self._completed[:0] = completed[index:]
+                return
+            self._release(ids)
+
+    def _dispatch(self, rows):
+        groups = {}
+        for row_id, kind, chat_id, payload, priority in rows:
+            key = (kind, chat_id) if kind in self.coalesce_kinds else (kind, chat_id, row_id)
+            group = groups.setdefault(key, {"ids": [], "payloads": [], "priority": priority})
+            group["ids"].append(row_id)
+            group["payloads"].append(payload)
+            group["priority"] = min(group["priority"], priority)
+
+        for (kind, chat_id, *_), group in groups.items():
+            ids = group["ids"]
+            try:
+                if kind == KIND_TEXT:
+                    payload = group["payloads"][0]
+                    text, kwargs = payload["text"], payload.get("kwargs") or {}
+                else:
+                    text, kwargs = self.renderers[kind](chat_id, group["payloads"])
+            except Exception as e:
+                logger.error(f"Could not render Sidekick outbox entries {ids} ({kind}): {e}", exc_info=True)
+                self._count("failed", len(ids))
+                self._finish(ids, "failed", e)
+                continue
+            with self._lock:
+                self._inflight.update(ids)
+            if not self.outbound.send(chat_id, text, priority=group["priority"], on_done=self._on_delivery(ids), **kwargs):
+                self._release(ids)
+                self._count("requeued", len(ids))
+                self._finish(ids, "pending")
+
+    def _loop(self):
+        logger.info("Sidekick outbox dispatcher started.")
+        while not self._stopped:
+            wait = self.poll_interval
+            try:
+                self._write_completed()
+                rows, wait = self._claim_batch()
+                if rows:
+                    self._count("claimed", len(rows))
+                    self._dispatch(rows)
+                    if len(rows) >= self.batch_size:
+                        wait = 0.0  # More may be waiting; go again right away.
+            except Exception as e:
+                logger.error(f"Sidekick outbox dispatch pass failed: {e}", exc_info=True)
+            if wait > 0 and self._wakeup.wait(wait):
+                self._wakeup.clear()
+        self._write_completed()
+
+    # --- Lifecycle & Observation ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name="sidekick-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, bypassed=self.gate.bypassed, inflight=len(self._inflight), unwritten=len(self._completed), running=bool(self._thread and self._thread.is_alive()))
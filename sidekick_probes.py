@@ -0,0 +1,138 @@
+# sidekick_probes.py
+import logging
+import threading
+import time
+
+from sidekick_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEPENDENCY_UP = REGISTRY.gauge(
+    "sidekick_dependency_up", "1 if the last probe of a dependency succeeded.", labels=("dependency",))
+DEPENDENCY_PROBE_SECONDS = REGISTRY.gauge(
+    "sidekick_dependency_probe_seconds", "Latency of the last probe of a dependency.", labels=("dependency",))
+
+
+# ==========================
+#  🩺 DEPENDENCY PROBES
+# ==========================
+class ProbeSkipped(Exception):
+    """Raised by a check that can't run yet; recorded as "not_initialized" rather than as a failure."""
+
+
+class Probe:
+    """
+    Checks one dependency every `interval` seconds on its own thread and
+    keeps the last result, so health routes only ever read memory.
+
+    `check()` succeeds by returning and fails by raising. Each attempt runs
+    on a short-lived thread; if it hasn't answered within `timeout` the probe
+    is marked as timed out, and no new attempt starts until the hung one
+    returns (its late result is still recorded). A probe without a check
+    reports "disabled", and one whose check raises ProbeSkipped reports
+    "not_initialized". Only `required` probes count towards readiness.
+    """
+
+    def __init__(self, name, check, interval=30.0, timeout=5.0, required=True):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.timeout = timeout
+        self.required = required
+
+        self.status = "disabled" if check is None else "unknown"
+        self.latency = None
+        self.checked_at = None
+        self.error = None
+        self._attempt_thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def ok(self):
+        return self.status in ("ok", "disabled")
+
+    def _record(self, status, latency, error=None):
+        with self._lock:
+            self.status, self.latency, self.error = status, latency, error
+            self.checked_at = time.time()
+        DEPENDENCY_UP.labels(dependency=self.name).set(1 if status == "ok" else 0)
+        DEPENDENCY_PROBE_SECONDS.labels(dependency=self.name).set(latency)
+
+    def _attempt(self):
+        started = time.perf_counter()
+        try:
+            self.check()
+        except ProbeSkipped as e:
+            self._record("not_initialized", time.perf_counter() - started, str(e) or None)
+        except Exception as e:
+            self._record("failing", time.perf_counter() - started, str(e) or type(e).__name__)
+        else:
+            self._record("ok", time.perf_counter() - started)
+
+    def run_once(self):
+        if self.check is None:
+            return
+        if self._attempt_thread and self._attempt_thread.is_alive():
+            logger.warning(f"Probe {self.name} is still waiting on its previous attempt.")
+            return
+        was_ok = self.status == "ok"
+        attempt = threading.Thread(target=self._attempt, name=f"sidekick-probe-{self.name}-attempt", daemon=True)
+        self._attempt_thread = attempt
+        attempt.start()
+        attempt.join(self.timeout)
+        if attempt.is_alive():
+            self._record("timeout", self.timeout, f"no answer within {self.timeout:.1f}s")
+        if was_ok and self.status != "ok":
+            logger.warning(f"Dependency {self.name} is {self.status}: {self.error}")
+        elif not was_ok and self.status == "ok":
+            logger.info(f"Dependency {self.name} is healthy ({self.latency * 1000:.0f} ms).")
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Probe {self.name} crashed: {e}", exc_info=True)
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        if self.check is None or (self._thread and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name=f"sidekick-probe-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "status": self.status,
+                "required": self.required,
+                "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+                "age_seconds": None if self.checked_at is None else round(time.time() - self.checked_at, 1),
+                "interval_seconds": self.interval,
+                "error": self.error,
+            }
+
+
+class DependencyProbes:
+    def __init__(self, probes):
+        self.probes = {probe.name: probe for probe in probes}
+
+    def start(self):
+        for probe in self.probes.values():
+            probe.start()
+
+    def stop(self):
+        for probe in self.probes.values():
+            probe.stop()
+
+    def ready(self):
+        return all(probe.ok for probe in self.probes.values() if probe.required)
+
+    def snapshot(self):
+        return {name: probe.snapshot() for name, probe in self.probes.items()}
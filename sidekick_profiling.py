@@ -0,0 +1,175 @@
+# sidekick_profiling.py
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+
+PROFILE_MAX_SECONDS = 60.0
+
+
+# ==========================
+#  🔬 SAMPLING PROFILER
+# ==========================
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler across every thread.
+
+    cProfile only sees the thread that enabled it, which misses the webhook
+    workers, sender threads and short-lived tasks we care about. Instead a
+    sampler thread reads `sys._current_frames()` every `interval` seconds
+    for the length of a session and counts, per function, how often it was
+    on the stack (total) or on top (self), plus whole collapsed stacks.
+    Nothing runs outside a session, and only one session runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def profile(self, seconds, interval=0.005, limit=40):
+        """Samples for `seconds` and returns the aggregated stats, or None if a session is already running."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._run(min(max(seconds, 0.1), PROFILE_MAX_SECONDS), max(interval, 0.001), limit)
+        finally:
+            self._lock.release()
+
+    def _run(self, seconds, interval, limit):
+        own = threading.get_ident()
+        names = {}
+        self_counts, total_counts, stacks = Counter(), Counter(), Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                self_counts[stack[0]] += 1
+                total_counts.update(set(stack))
+                stacks[f"{_thread_group(names.get(ident, str(ident)))};" + ";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        elapsed = time.perf_counter() - started
+        return {
+            "seconds": round(elapsed, 3),
+            "samples": samples,
+            "interval_ms": round(interval * 1000, 2),
+            "self": [{"function": name, "samples": count} for name, count in self_counts.most_common(limit)],
+            "total": [{"function": name, "samples": count} for name, count in total_counts.most_common(limit)],
+            # Collapsed stacks (root first), ready for flamegraph.pl or speedscope.
+            "stacks": [f"{stack} {count}" for stack, count in stacks.most_common(limit * 5)],
+        }
+
+
+def _thread_group(name):
+    # "sidekick-outbound-2" and "sidekick-outbound-3" share one flame graph root.
+    return name.rstrip("0123456789").rstrip("-_") or name
+
+
+# ==========================
+#  🧠 ALLOCATION SNAPSHOTS
+# ==========================
+class AllocationTracker:
+    """
+    tracemalloc on demand. `start()` begins tracing; each `snapshot()`
+    reports the top allocation sites and the diff against the previous
+    snapshot; `stop()` ends tracing and frees the traces. Allocation costs
+    are only paid between start and stop.
+    """
+
+    def __init__(self):
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def start(self, frames=10):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(1, frames))
+                self._previous = None
+            return self.status()
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+            return self.status()
+
+    def status(self):
+        if not tracemalloc.is_tracing():
+            return {"tracing": False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {"tracing": True, "frames": tracemalloc.get_traceback_limit(),
+                "current_bytes": current, "peak_bytes": peak}
+
+    def snapshot(self, limit=25, group_by="lineno"):
+        """Top allocation sites and the change since the last snapshot; None when tracing is off."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            previous, self._previous = self._previous, snapshot
+        result = dict(self.status(), top=[_stat(stat) for stat in snapshot.statistics(group_by)[:limit]])
+        if previous is not None:
+            result["diff"] = [_stat(stat) for stat in snapshot.compare_to(previous, group_by)[:limit]]
+        return result
+
+
+def _stat(stat):
+    entry = {"where": str(stat.traceback[0]) if stat.traceback else "?", "size_bytes": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry.update(size_diff_bytes=stat.size_diff, count_diff=stat.count_diff)
+    return entry
+
+
+# ==========================
+#  🧵 THREAD DUMP
+# ==========================
+def _thread_started_at(native_id):
+    """Start time (epoch seconds) of an OS thread from /proc, or None where that isn't available."""
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as stat_file:
+            # Fields after the ")" that closes the command name; starttime is field 22 overall.
+            started_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return time.time() - uptime + started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def thread_dump():
+    frames = sys._current_frames()
+    now = time.time()
+    threads = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        started_at = _thread_started_at(thread.native_id) if thread.native_id else None
+        threads.append({
+            "name": thread.name,
+            "ident": thread.ident,
+            "daemon": thread.daemon,
+            "age_seconds": None if started_at is None else round(now - started_at, 1),
+            "stack": traceback.format_stack(frame) if frame is not None else [],
+        })
+    threads.sort(key=lambda entry: entry["age_seconds"] or 0.0, reverse=True)
+    return {"count": len(threads), "threads": threads}
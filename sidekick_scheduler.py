@@ -0,0 +1,243 @@
+# sidekick_scheduler.py
+import heapq
+import itertools
+import logging
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sidekick_metrics import SCHEDULER_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+# ==========================
+#  🗓️ SCHEDULE TABLE
+# ==========================
+class ScheduledTask:
+    """
+    One entry of the schedule table: a daily slot at `hour:minute` in `tz`
+    (UTC by default), or a weekly slot when `day_of_week` is given (Monday == 0).
+
+    A slot that was missed (process asleep, restarted, ...) still runs if it is
+    picked up within `grace` seconds. By default that is the rest of the hour
+    for daily tasks and the rest of the day for weekly ones.
+    """
+
+    def __init__(self, name, task, hour, minute=0, day_of_week=None, args=(), grace=None, tz=None):
+        self.name = name
+        self.task = task
+        self.hour = hour
+        self.minute = minute
+        self.day_of_week = day_of_week
+        self.args = args
+        self.tz = tz or timezone.utc
+        if grace is None:
+            grace = (24 - hour) * 3600 - minute * 60 if self.is_weekly else (60 - minute) * 60
+        self.grace = grace
+
+    @property
+    def is_weekly(self):
+        return self.day_of_week is not None
+
+    def run_marker(self, slot):
+        return slot.strftime('%Y-W%U') if self.is_weekly else slot.strftime('%Y-%m-%d-%H')
+
+    def _slot_on(self, day):
+        return day.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+
+    def previous_slot(self, now):
+        """Most recent slot at or before `now`."""
+        # Slots are computed on the local wall clock; adding days keeps the wall time across DST changes.
+        now = now.astimezone(self.tz)
+        slot = self._slot_on(now)
+        if self.is_weekly:
+            slot -= timedelta(days=(now.weekday() - self.day_of_week) % 7)
+            if slot > now:
+                slot -= timedelta(days=7)
+        elif slot > now:
+            slot -= timedelta(days=1)
+        return slot
+
+    def next_slot(self, after):
+        """First slot strictly after `after`."""
+        return self.previous_slot(after) + timedelta(days=7 if self.is_weekly else 1)
+
+
+class _ClaimedRun:
+    """What the runner receives for a claimed slot: same name/task/args shape as a ScheduledTask."""
+
+    def __init__(self, name, task):
+        self.name = name
+        self.task = task
+        self.args = ()
+
+
+# ==========================
+#  ⏰ TIMER-HEAP SCHEDULER
+# ==========================
+class Scheduler:
+    """
+    Runs a compiled schedule table from a background thread.
+
+    Upcoming slots live in a min-heap keyed by fire time, so the thread sleeps
+    until the next one is due instead of re-checking every entry. Due slots
+    are claimed through the ScheduleLogStore before anything runs, so a slot
+    runs once even with several replicas; the outcome is reported back to
+    the store when the task finishes.
+
+    A slot that is still held by another replica, or could not be claimed at
+    all, is checked again (when that lease runs out, or after
+    `retry_interval` seconds) until its grace window closes, so a replica
+    that dies mid-run doesn't lose the post.
+    """
+
+    def __init__(self, store, tasks, jitter=0.0, max_sleep=60.0, clock=None, runner=None, retry_interval=60.0):
+        self.store = store
+        self.tasks = list(tasks)
+        self.jitter = jitter
+        self.max_sleep = max_sleep
+        self.retry_interval = retry_interval
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.runner = runner or self._run_in_thread
+
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.last_runs = {}
+
+        now = self.clock()
+        for task in self.tasks:
+            # Start from the latest slot so a window missed during downtime is caught up.
+            previous = task.previous_slot(now)
+            slot = previous if (now - previous).total_seconds() < task.grace else task.next_slot(now)
+            self._push(task, slot)
+
+    def _push(self, task, slot):
+        fire_at = slot + timedelta(seconds=random.uniform(0, self.jitter)) if self.jitter else slot
+        heapq.heappush(self._heap, (fire_at, next(self._seq), slot, task, False))
+
+    def _push_recheck(self, task, slot, at):
+        """Looks at an unsettled slot again at `at`, as long as that is still inside its grace window."""
+        if (at - slot).total_seconds() >= task.grace:
+            logger.warning(f"Sidekick schedule slot {task.name} ({task.run_marker(slot)}) never settled within its grace window.")
+            return
+        with self._lock:
+            # Rechecks don't schedule the following slot; the original entry already did.
+            heapq.heappush(self._heap, (at, next(self._seq), slot, task, True))
+
+    def _run_in_thread(self, task):
+        threading.Thread(target=task.task, args=task.args, daemon=True).start()
+
+    def _claimed_run(self, task, run_marker):
+        """Wraps a claimed task so its outcome is recorded once it actually runs."""
+        def run():
+            try:
+                task.task(*task.args)
+            except Exception as e:
+                self.store.finish(task.name, run_marker, "failed", e)
+                raise
+            self.store.finish(task.name, run_marker, "done")
+        return _ClaimedRun(task.name, run)
+
+    # --- Execution ---
+    def run_pending(self, now=None):
+        now = now or self.clock()
+        with self._lock:
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, slot, task, recheck = heapq.heappop(self._heap)
+                due.append((slot, task))
+                if not recheck:
+                    self._push(task, task.next_slot(slot))
+        if not due:
+            return []
+
+        states = self.store.get_states()
+        candidates = {}
+        for slot, task in due:
+            lag = (now - slot).total_seconds()
+            run_marker = task.run_marker(slot)
+            if lag >= task.grace:
+                logger.warning(f"Sidekick skipped missed schedule slot {task.name} ({run_marker}), {lag:.0f}s late.")
+                continue
+            if task.name in candidates:
+                continue
+            marker, status, lease_expires_at = states.get(task.name, (None, None, None))
+            if marker == run_marker:
+                if status != "running":
+                    continue  # Already ran (or failed) for this slot
+                if lease_expires_at is not None and lease_expires_at > now:
+                    # Someone is still on it; if they die, take over once the lease has run out.
+                    self._push_recheck(task, slot, lease_expires_at + timedelta(seconds=1))
+                    continue
+            candidates[task.name] = (slot, task, run_marker, lag)
+        if not candidates:
+            return []
+
+        # One conditional upsert claims every due slot; only the winners run here.
+        claimed = self.store.claim_many({name: candidate[2] for name, candidate in candidates.items()})
+        started = []
+        for name, (slot, task, run_marker, lag) in candidates.items():
+            if name not in claimed:
+                logger.info(f"Sidekick schedule slot {name} ({run_marker}) not claimed here; checking again later.")
+                self._push_recheck(task, slot, now + timedelta(seconds=self.retry_interval))
+                continue
+            try:
+                logger.info(f"Sidekick is running scheduled task: {name}")
+                self.runner(self._claimed_run(task, run_marker))
+                self.last_runs[name] = {"slot": slot.isoformat(), "lag_seconds": lag}
+                SCHEDULER_LAG_SECONDS.labels(task=name).set(lag)
+                started.append(name)
+            except Exception as e:
+                self.store.finish(name, run_marker, "failed", e)
+                logger.error(f"Error running Sidekick scheduled task {name}: {e}", exc_info=True)
+        return started
+
+    def _loop(self):
+        logger.info(f"Sidekick scheduler started with {len(self.tasks)} tasks.")
+        while not self._stopped:
+            with self._lock:
+                next_fire = self._heap[0][0] if self._heap else None
+            delay = self.max_sleep
+            if next_fire is not None:
+                delay = min(delay, max(0.0, (next_fire - self.clock()).total_seconds()))
+            # Wake up at least every `max_sleep` seconds to absorb wall-clock jumps.
+            if delay > 0 and self._wakeup.wait(delay):
+                self._wakeup.clear()
+                continue
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.error(f"Sidekick scheduler pass failed: {e}", exc_info=True)
+
+    # --- Lifecycle & Observation ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name="sidekick-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def status(self):
+        now = self.clock()
+        with self._lock:
+            upcoming = sorted(self._heap)[:3]
+        return {
+            "running": self.is_alive(),
+            "next": [
+                {"task": task.name, "due_in_seconds": round((fire_at - now).total_seconds(), 1)}
+                for fire_at, _, _, task, _ in upcoming
+            ],
+            "last_runs": dict(self.last_runs),
+        }
@@ -0,0 +1,203 @@
+# sidekick_tasks.py
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_REJECT = "reject"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+
+
+# ==========================
+#  ⏳ DELAYED TASK EXECUTOR
+# ==========================
+class DelayedTask:
+    """Handle returned by DelayedExecutor.submit(); can be cancelled until it starts."""
+
+    def __init__(self, seq, run_at, func, args, kwargs, name, evictable=True):
+        self.seq = seq
+        self.run_at = run_at
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name
+        self.evictable = evictable
+        self.cancelled = False
+        self.started = False
+        self._executor = None
+
+    def cancel(self):
+        return self._executor._cancel(self) if self._executor else False
+
+
+class DelayedExecutor:
+    """
+    Runs callables after a delay on a fixed pool of worker threads.
+
+    A single timer thread keeps pending tasks in a heap ordered by due time and
+    hands them to the workers once due, so the number of threads stays constant
+    no matter how many replies are waiting. At most `max_pending` tasks may be
+    waiting; beyond that the overflow policy either rejects the new task or
+    drops the oldest pending one. Tasks submitted with `evictable=False` are
+    never dropped or rejected (callers keep their number bounded, e.g. one
+    per chat); when only such tasks are waiting, new evictable ones are
+    rejected instead.
+    """
+
+    def __init__(self, workers=4, max_pending=1000, overflow=OVERFLOW_DROP_OLDEST, name="sidekick-task"):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.overflow = overflow
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._pending = OrderedDict()  # seq -> DelayedTask, in submission order
+        self._ready = queue.Queue()
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopped = False
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "dropped": 0}
+
+    # --- Submission ---
+    def submit(self, delay, func, *args, name=None, evictable=True, **kwargs):
+        task = DelayedTask(next(self._seq), time.monotonic() + max(0.0, delay), func, args, kwargs,
+                           name or getattr(func, "__name__", "task"), evictable)
+        task._executor = self
+        dropped = None
+        with self._cond:
+            if evictable and len(self._pending) >= self.max_pending:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    dropped = next((pending for pending in self._pending.values() if pending.evictable), None)
+                if dropped is None:
+                    self.stats["dropped"] += 1
+                    logger.warning(f"Sidekick task queue full ({self.max_pending}); rejected '{task.name}'.")
+                    return None
+                del self._pending[dropped.seq]
+                dropped.cancelled = True
+                self.stats["dropped"] += 1
+            self._pending[task.seq] = task
+            if len(self._heap) >= 2 * self.max_pending:
+                # Cancelled entries are removed lazily; compact before they pile up.
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+            heapq.heappush(self._heap, (task.run_at, task.seq, task))
+            self.stats["submitted"] += 1
+            self._cond.notify()
+        if dropped:
+            logger.warning(f"Sidekick task queue full ({self.max_pending}); dropped oldest '{dropped.name}'.")
+        return task
+
+    def _cancel(self, task):
+        with self._cond:
+            if task.started or task.cancelled:
+                return False
+            task.cancelled = True
+            self._pending.pop(task.seq, None)
+            self.stats["cancelled"] += 1
+            return True
+
+    # --- Threads ---
+    def _timer_loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= time.monotonic():
+                        break
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+                self._pending.pop(task.seq, None)
+                task.started = True
+            self._ready.put(task)
+
+    def _worker_loop(self):
+        while True:
+            task = self._ready.get()
+            if task is None:
+                return
+            try:
+                task.func(*task.args, **task.kwargs)
+                outcome = "completed"
+            except Exception as e:
+                outcome = "failed"
+                logger.error(f"Sidekick delayed task '{task.name}' failed: {e}", exc_info=True)
+            with self._cond:
+                self.stats[outcome] += 1
+
+    def start(self):
+        if self._threads:
+            return
+        self._threads.append(threading.Thread(target=self._timer_loop, name=f"{self.name}-timer", daemon=True))
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for _ in range(self.workers):
+            self._ready.put(None)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, pending=len(self._pending), ready=self._ready.qsize(), workers=self.workers)
+
+
+# ==========================
+#  🧺 KEYED COALESCER
+# ==========================
+class Coalescer:
+    """
+    Collects items per key for `window` seconds and hands them over in one batch.
+
+    The first item for a key schedules a single flush on the DelayedExecutor;
+    later items in the same window just join the batch. At most `max_items`
+    are kept per batch, anything beyond that is only counted. Flushes are
+    submitted as non-evictable (there is at most one per key), since a
+    dropped flush would leave its batch waiting forever.
+    """
+
+    def __init__(self, executor, window, flush_func, max_items=200, name="coalesce"):
+        self.executor = executor
+        self.window = window
+        self.flush_func = flush_func
+        self.max_items = max_items
+        self.name = name
+        self._lock = threading.Lock()
+        self._batches = {}  # key -> [items, overflow_count]
+
+    def add(self, key, items):
+        with self._lock:
+            batch = self._batches.get(key)
+            is_new = batch is None
+            if is_new:
+                batch = self._batches[key] = [[], 0]
+            room = self.max_items - len(batch[0])
+            batch[0].extend(items[:room])
+            batch[1] += max(0, len(items) - room)
+        if is_new and not self.executor.submit(self.window, self._flush, key, name=self.name, evictable=False):
+            # The executor refused the flush; forget the batch so the next item retries.
+            with self._lock:
+                self._batches.pop(key, None)
+
+    def _flush(self, key):
+        with self._lock:
+            items, overflow = self._batches.pop(key, ([], 0))
+        if items or overflow:
+            self.flush_func(key, items, overflow)
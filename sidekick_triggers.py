@@ -0,0 +1,53 @@
+# sidekick_triggers.py
+import re
+
+
+# ==========================
+#  🎯 MULTI-PATTERN MATCHER
+# ==========================
+class TriggerMatcher:
+    """
+    Finds every trigger contained in a message with a single regex scan.
+
+    All literals are compiled into one alternation wrapped in a lookahead, so
+    the scan reports a match at every position (overlapping triggers
+    included) without consuming text. Alternatives are ordered longest first;
+    shorter literals that could be prefixes of a match are kept in a
+    precomputed table and checked against the matched text, so nothing
+    sharing a start position is lost.
+
+    `triggers` is an iterable of (trigger_id, literal, case_sensitive).
+    """
+
+    def __init__(self, triggers):
+        self._ids = {}  # (literal key, case_sensitive) -> set of trigger ids
+        for trigger_id, literal, case_sensitive in triggers:
+            if not literal:
+                continue
+            key = (literal if case_sensitive else literal.lower(), case_sensitive)
+            self._ids.setdefault(key, set()).add(trigger_id)
+
+        literals = sorted(self._ids, key=lambda key: len(key[0]), reverse=True)
+        self._related = {
+            key: [other for other in literals
+                  if other != key and len(other[0]) <= len(key[0]) and key[0].lower().startswith(other[0].lower())]
+            for key in literals
+        }
+        alternatives = [re.escape(text) if case_sensitive else f"(?i:{re.escape(text)})"
+                        for text, case_sensitive in literals]
+        self._regex = re.compile(f"(?=({'|'.join(alternatives)}))") if alternatives else None
+
+    def match(self, text):
+        """Returns the set of trigger ids found in `text`."""
+        found = set()
+        if not self._regex or not text:
+            return found
+        for m in self._regex.finditer(text):
+            matched = m.group(1)
+            lowered = matched.lower()
+            key = (matched, True) if (matched, True) in self._ids else (lowered, False)
+            found |= self._ids.get(key, set())
+            for other, case_sensitive in self._related.get(key, ()):
+                if (matched if case_sensitive else lowered).startswith(other):
+                    found |= self._ids[(other, case_sensitive)]
+        return found